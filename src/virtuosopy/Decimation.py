@@ -0,0 +1,69 @@
+# Min/max envelope decimation for plotting long waves.
+#
+# A MinMaxPyramid keeps the wave at several resolutions, each level holding the minimum and maximum of every
+# factor samples of the level below. Drawing a level as alternating min/max points keeps every peak and glitch of the
+# full wave visible while plotting only about as many points as there are pixels. Zooming in picks a finer level
+# (or the raw samples) for the visible window, found by binary search.
+
+import numpy as np
+
+
+class MinMaxPyramid:
+    def __init__(self, x, y, factor=4, min_points=1000):
+        """
+        Parameters
+        ----------
+        x, y : np arrays of one wave, x sorted
+        factor : int
+            number of samples of a level combined into one min/max pair of the next level
+        min_points : int
+            levels stop once they have fewer bins than this
+        """
+        self.x = x
+        self.y = y
+        # (x of the start of each bin, min, max), finest level first
+        self.levels = []
+
+        xs = np.asarray(x)
+        lo = np.asarray(y)
+        hi = lo
+        while len(xs) > min_points:
+            idx = np.arange(0, len(xs), factor)
+            lo = np.minimum.reduceat(lo, idx)
+            hi = np.maximum.reduceat(hi, idx)
+            xs = xs[idx]
+            self.levels.append((xs, lo, hi))
+
+    # minimum and maximum of the whole wave
+    def range(self):
+        if len(self.levels) == 0:
+            return np.min(self.y), np.max(self.y)
+        _, lo, hi = self.levels[-1]
+        return np.min(lo), np.max(hi)
+
+    def points(self, t0, t1, n_points):
+        """
+        Return (x, y) to draw the wave between t0 and t1 with at most about n_points points
+        """
+        i0, i1 = _window(self.x, t0, t1)
+        if i1 - i0 <= n_points or len(self.levels) == 0:
+            return np.asarray(self.x[i0:i1]), np.asarray(self.y[i0:i1])
+
+        # the finest level which is coarse enough
+        xs, lo, hi = self.levels[-1]
+        for level in self.levels:
+            j0, j1 = _window(level[0], t0, t1)
+            if 2 * (j1 - j0) <= n_points:
+                xs, lo, hi = level
+                break
+
+        j0, j1 = _window(xs, t0, t1)
+        # each bin is drawn as a vertical stroke from its min to its max
+        return np.repeat(xs[j0:j1], 2), np.column_stack((lo[j0:j1], hi[j0:j1])).ravel()
+
+
+# indices of the samples inside [t0, t1], widened by one sample on each side so lines reach the edges of the window
+def _window(x, t0, t1):
+    i0 = max(np.searchsorted(x, t0, side='left') - 1, 0)
+    i1 = min(np.searchsorted(x, t1, side='right') + 1, len(x))
+    return i0, i1
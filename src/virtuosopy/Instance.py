@@ -1,26 +1,148 @@
 from collections import namedtuple
 import numpy as np
+import json
+import os
 
 from .vp_utils import *
+from .vp_skill import define_skill
+
+
+# process wide cache of symbol data keyed on (lib_name, cell_name, view), so placing many instances of the same
+# cell only fetches its pins and CDF parameters once:
+#   'ports'  - list of [pin name, pin bBox] in symbol coordinates
+#   'params' - list of [CDF parameter name, default value]
+#   'stamps' - list of [file, modified time] of the cell (its CDF) and the view, see vpViewStamps
+# the opened symbol cellviews are also kept, per workspace
+# the stamps of an entry are compared with the library once per process, so an entry persisted before the symbol or
+# its CDF was edited is fetched again
+class _SymbolCache:
+    def __init__(self):
+        self.entries = {}
+        self.cvs = {}
+        # keys whose stamps were checked in this process
+        self.checked = set()
+        # json file the entries are kept in, see persist()
+        self.path = None
+        # called with (lib_name, cell_name) when entries are invalidated
+        self.on_invalidate = []
+
+    def get(self, ws, lib_name, cell_name, view="symbol"):
+        key = (lib_name, cell_name, view)
+        if key in self.entries and key in self.checked:
+            return self.entries[key]
+
+        stamps = self.stamps(ws, lib_name, cell_name, view)
+        if key in self.entries and self.entries[key].get('stamps') != stamps:
+            self.invalidate(lib_name, cell_name)
+
+        if key not in self.entries:
+            pl = ws.sch.symbol_to_pin_list(lib_name, cell_name, view)
+            ports = []
+            for x in pl["ports"]:
+                bbox = x["pins"][0]["fig"]["bBox"]
+                ports.append([x["name"], [list(bbox[0]), list(bbox[1])]])
+
+            define_skill(ws, 'vpCellCDFParams')
+            params = ws['vpCellCDFParams'](lib_name, cell_name)
+            params = [[p[0], p[1]] for p in params] if params is not None else []
+
+            self.entries[key] = {'ports': ports, 'params': params, 'stamps': stamps}
+            self.save()
+
+        self.checked.add(key)
+        return self.entries[key]
+
+    # [file, modified time] of the files of the cell and the view, sorted so they can be compared after a json round trip
+    @staticmethod
+    def stamps(ws, lib_name, cell_name, view="symbol"):
+        define_skill(ws, 'vpViewStamps')
+        stamps = ws['vpViewStamps'](lib_name, cell_name, view)
+        return sorted([str(f), int(t)] for f, t in stamps or [])
+
+    def symbol_cv(self, ws, lib_name, cell_name, view="symbol"):
+        key = (id(ws), lib_name, cell_name, view)
+        if key not in self.cvs:
+            self.cvs[key] = ws.db.open_cell_view(lib_name, cell_name, view)
+        return self.cvs[key]
+
+    # drops the symbol cellviews opened in a workspace, eg. after it reconnected to a new session
+    def forget_workspace(self, ws):
+        self.cvs = {k: v for k, v in self.cvs.items() if k[0] != id(ws)}
+
+    def invalidate(self, lib_name=None, cell_name=None):
+        """
+        Drop cached symbols, eg. after a symbol or its CDF was edited
+
+        Parameters
+        ----------
+        lib_name : string
+            library to drop, None for every library
+        cell_name : string
+            cell to drop, None for every cell in the library
+        """
+        def match(lib, cell):
+            return (lib_name is None or lib == lib_name) and (cell_name is None or cell == cell_name)
+
+        self.entries = {k: v for k, v in self.entries.items() if not match(k[0], k[1])}
+        self.checked = {k for k in self.checked if not match(k[0], k[1])}
+        self.cvs = {k: v for k, v in self.cvs.items() if not match(k[1], k[2])}
+        self.save()
+
+        for fn in self.on_invalidate:
+            fn(lib_name, cell_name)
+
+    def persist(self, path):
+        # keep the entries in a json file, entries already in the file are loaded for a warm start
+        # (and checked against the library the first time they are used)
+        self.path = path
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for k, v in json.load(f).items():
+                    self.entries.setdefault(tuple(k.split('\t')), v)
+        self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        with open(self.path, 'w') as f:
+            json.dump({'\t'.join(k): v for k, v in self.entries.items()}, f, default=str)
+
+
+symbol_cache = _SymbolCache()
 
 
 # holds parameter information and allows setting of parameters
+# parameter names come from the symbol cache, the CDF parameter objects are only fetched when used
 class _Params:
     def __init__(self, inst):
         self.ws = inst.ws
+        self._inst = inst
+        self._cdf = None
+        self._objs = {}
+        # name without '?' -> CDF parameter name
+        self._cdf_names = {}
         self.names = []
-        inst_cdf = inst.ws.cdf.get_inst_CDF(inst.inst)
-        if inst_cdf is not None:
-            params = inst_cdf.parameters
-            if params is not None:
-                for x in params:
-                    param_name = x.name.replace("?", "")
-                    self.names.append(param_name)
-                    setattr(self, param_name, x)
-            else:
-                print(f"Instance.py Warning: unable to get params for instance '{inst.name}'")
-        else:
-            print(f"Instance.py Warning: unable to get inst CDF for '{inst.name}'")
+        for p_name, _ in symbol_cache.get(inst.ws, inst.lib_name, inst.cell_name)['params']:
+            param_name = p_name.replace("?", "")
+            self.names.append(param_name)
+            self._cdf_names[param_name] = p_name
+
+    def defaults(self):
+        return {p[0].replace("?", ""): p[1] for p in symbol_cache.get(self.ws, self._inst.lib_name, self._inst.cell_name)['params']}
+
+    def __getattr__(self, key):
+        if key.startswith('_') or key not in self._cdf_names:
+            raise AttributeError(key)
+
+        if key not in self._objs:
+            if self._cdf is None:
+                self._cdf = self.ws.cdf.get_inst_CDF(self._inst.inst)
+                if self._cdf is None:
+                    print(f"Instance.py Warning: unable to get inst CDF for '{self._inst.name}'")
+                    raise AttributeError(key)
+            self._objs[key] = self.ws.cdf.find_param_by_name(self._cdf, self._cdf_names[key])
+
+        return self._objs[key]
 
     def __setitem__(self, key, value):
         getattr(self, key).value = value
@@ -33,6 +155,8 @@ class _Params:
 
 
 class _Pin:
+    __slots__ = ('fname', 'name', 'pos', 'x', 'y', 'netname')
+
     def __init__(self, fname, name, pos , x, y, netname):
         self.fname = fname
         self.name = name
@@ -48,32 +172,18 @@ class _Pin:
 class _Pins:
     def __init__(self, inst):
 
-        pl = inst.ws.sch.symbol_to_pin_list(inst.inst.lib_name,
-                                            inst.inst.cell_name, "symbol")
-
-        self.names = [x["name"] for x in pl["ports"]]
-
-        for x in pl["ports"]:
-            bbox = x["pins"][0]["fig"]["bBox"]
-            # get pos from virtuoso coords
-            pos = calc_center(bbox)
-            pos = np.asarray(pos)
-
-            if inst.mirrored == 'Y':
-                pos[0] = -pos[0]
-            elif inst.mirrored == 'X':
-                pos[1] = -pos[1]
+        ports = symbol_cache.get(inst.ws, inst.lib_name, inst.cell_name)['ports']
 
-            pos = [pos[0] + inst.vpos[0], pos[1] + inst.vpos[1]]
+        self.names = [name for name, _ in ports]
 
-            pos = rotate(pos, inst.vpos, inst.rot)
+        # all pin positions at once, transformed out of virtuoso coords
+        positions = i_transform(place_pins([bbox for _, bbox in ports], inst.vpos, inst.orient))
 
-            # transform out of virtuoso coords
-            pos = i_transform(pos)
-            full_name = f"/{inst.name}/{x['name']}"
-            p = _Pin(full_name, x["name"], pos, pos[0], pos[1], None)
+        for (p_name, _), pos in zip(ports, positions):
+            full_name = f"/{inst.name}/{p_name}"
+            p = _Pin(full_name, p_name, pos, pos[0], pos[1], None)
             # p = Pin(pos[0], pos[1])
-            setattr(self, x["name"], p)
+            setattr(self, p_name, p)
 
     def __getitem__(self, key):
         try:
@@ -86,8 +196,10 @@ class _Pins:
 
 
 # Allows creation and manipulation of a symbol in a schematic
+# with a batch (see Schematic.batch) the instance is only created in Virtuoso when the batch is flushed,
+# until then its pins are known but its parameters can only be set, not read
 class _Inst:
-    def __init__(self, ws, cv, lib_name, cell_name, pos, name, rot):
+    def __init__(self, ws, cv, lib_name, cell_name, pos, name, rot, batch=None, existing=None):
 
         self.ws = ws
         self.cv = cv
@@ -100,21 +212,43 @@ class _Inst:
         else:
             self.vpos = transform(self.pos)
 
-        if rot[0] != 'M':
-            self.mirrored = False
-            self.rot = int(rot[1:])
-        else:
-            self.mirrored = rot[1]  # will be 'X' or 'Y'
-            if len(rot) > 2:
-                self.rot = int(rot[3:])
-            else:
-                self.rot = 0
+        # mirrored will be False, 'X' or 'Y'
+        self.mirrored, self.rot = parse_orient(rot)
 
         self.lib_name = lib_name
         self.cell_name = cell_name
         self.name = name
-
-        inst_cv = ws.db.open_cell_view(lib_name, cell_name, "symbol")
+        self.orient = rot
+        self.applied_params = {}
+        # parameter writes not yet sent to Virtuoso, see flush_params
+        self.pending_params = {}
+        # parameters set on the kept instance by the previous incremental run, see take_reset_ops
+        self.prev_params = None
+        # the batch this instance is created in, None once it exists in Virtuoso
+        self.batch = None
+
+        # built on first use, see the params and pins properties
+        self._params = None
+        self._pins = None
+
+        # incremental regeneration: existing is [lib, cell, xy, orient, params, inst] of the instance already in the
+        # cellview under this name, it is kept if nothing changed and replaced otherwise
+        if existing is not None:
+            if self.matches(existing):
+                self.inst_cv = None
+                self.inst = existing[5]
+                self.prev_params = existing[4]
+                return
+            ws.db.delete_object(existing[5])
+
+        if batch is not None:
+            self.inst_cv = None
+            self.inst = None
+            self.batch = batch
+            batch.add_inst(self)
+            return
+
+        inst_cv = symbol_cache.symbol_cv(ws, lib_name, cell_name)
         inst = ws.sch.create_inst(self.cv, inst_cv, name, list(self.vpos), rot)
         # inst = ws.sch.create_inst("analogLib", "nfet", "D0", [0., 0.], "R0")
 
@@ -122,20 +256,79 @@ class _Inst:
         self.inst_cv = inst_cv
         self.inst = inst
 
-        self.applied_params = {}
-        self.params = _Params(self)
-        self.pins = _Pins(self)
         # if cell_name == 'dgxnfet':
         #     self.params['s'] = 0
         #     self.params['d'] = 0
 
+    # CDF parameters, fetched from Virtuoso (or the symbol cache) on first access
+    @property
+    def params(self):
+        if self._params is None:
+            self._params = _Params(self)
+        return self._params
+
+    # pin positions, calculated on first access
+    @property
+    def pins(self):
+        if self._pins is None:
+            self._pins = _Pins(self)
+        return self._pins
+
+    def matches(self, existing):
+        lib_name, cell_name, xy, orient, _, _ = existing
+        return (lib_name == self.lib_name and cell_name == self.cell_name and orient == self.orient
+                and np.allclose(xy, self.vpos))
+
+    # called by the batch once the instance exists in Virtuoso
+    def resolve(self, inst):
+        self.inst = inst
+        self.batch = None
+
+    # parameter writes are buffered and sent together by flush_params (or Schematic.flush_params)
     def __setitem__(self, key, value):
+        if key not in self.params.names:
+            raise Exception(f"Error: parameter '{key}' does not exist on '{self.name}'. Available parameters: {self.params.names}")
+
         self.applied_params[key] = value
-        self.params[key] = value
+        if self.batch is not None:
+            self.batch.set_param(self, key, value)
+            return
+        self.pending_params[key] = value
 
     def __getitem__(self, key):
+        if self.batch is not None:
+            raise Exception(f"Parameters of '{self.name}' can not be read until its batch is flushed")
+        self.flush_params()
         return self.params[key].value
 
+    # returns the buffered parameter writes as vpBatch param ops and clears the buffer
+    def take_param_ops(self):
+        ops = [['param', self.name, k, v] for k, v in self.pending_params.items()]
+        self.pending_params = {}
+        return ops
+
+    # incremental regeneration: returns vpBatch ops which reset the parameters the previous run set and this one did
+    # not to their CDF defaults, and record the parameters this run set on the instance for the next run
+    def take_reset_ops(self):
+        prev = self.prev_params or []
+        names = sorted(self.applied_params)
+        ops = []
+        removed = [k for k in prev if k not in self.applied_params]
+        if len(removed) > 0:
+            defaults = self.params.defaults()
+            ops += [['param', self.name, k, defaults[k]] for k in removed if k in defaults]
+        if names != sorted(prev):
+            ops.append(['params', self.name, ' '.join(names)])
+        self.prev_params = names
+        return ops
+
+    # sends this instance's buffered parameter writes
+    def flush_params(self):
+        if len(self.pending_params) == 0:
+            return
+        define_skill(self.ws, 'vpBatch')
+        self.ws['vpBatch'](self.cv, self.take_param_ops())
+
     def __repr__(self):
         repr = ""
         repr += "Instance Name:\n\t"
@@ -156,9 +349,10 @@ class _Inst:
         repr += "\n"
 
         repr += "Parameter Names: \n\t"
-        for p in self.params:
-            repr += p.name
-            repr += ", "
+        if self.batch is None:
+            for p in self.params:
+                repr += p.name
+                repr += ", "
         repr += "\n"
 
         repr += "Applied Parameters: \n"
@@ -5,13 +5,21 @@ import numpy as np
 import os
 
 class Layout:
-    def __init__(self, lib_name, cell_name, ws_name="default", overwrite=False, verbose=True):
+    def __init__(self, lib_name, cell_name, ws_name="default", overwrite=False, verbose=True, pool=None):
         # ws_name = os.getenv('key')
 
-        if ws_name == "default":
+        # lease from a WorkspacePool instead of opening a new connection
+        self.pool = pool
+        if pool is not None:
+            ws = pool.lease(None if ws_name == "default" else ws_name)
+
+        elif ws_name == "default":
             net_id = os.getenv('USER')
             ws = Workspace.open(workspace_id=f'{net_id}_0')
 
+        else:
+            ws = Workspace.open(workspace_id=ws_name)
+
         # raise
         cv = ws.db.open_cell_view_by_type(lib_name, cell_name, "layout",
                                         "maskLayout", "w")
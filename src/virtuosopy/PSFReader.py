@@ -0,0 +1,300 @@
+# Reads Spectre PSF results straight from disk so waves can be loaded without SkillBridge or a live Virtuoso.
+#
+# PSF-ASCII is parsed here with numpy, the values a chunk at a time. The first time a file is read, its values are
+# saved next to it as <file>.npy (column-major, one column per trace) and its header and trace names as <file>.json.
+# Later reads memory-map the .npy without opening the PSF file.
+# Binary PSF has no public spec, so it is read through the optional libpsf package if it is installed.
+#
+# PSF-ASCII layout (transient):
+#   HEADER
+#   "PSFversion" "1.00"
+#   ...
+#   TYPE
+#   "sweep" FLOAT DOUBLE PROP( ... )
+#   "V" FLOAT DOUBLE PROP( ... )
+#   SWEEP
+#   "time" "sweep" PROP( ... )
+#   TRACE
+#   "D" "V"
+#   "nmos:D" "I"
+#   VALUE
+#   "time" 0.0
+#   "D" 1.2
+#   "nmos:D" 1e-06
+#   ...
+#   END
+
+import numpy as np
+import json
+import glob
+import os
+import re
+
+try:
+    import libpsf
+except ImportError:
+    libpsf = None
+
+class PSFFile:
+    # bytes of value lines parsed at a time
+    chunk_size = 1 << 24
+
+    def __init__(self, filename, mmap=True):
+        """
+        Load a swept PSF result file (eg. tran.tran)
+
+        Parameters
+        ----------
+        filename : string
+            path to the PSF file
+        mmap : bool
+            for PSF-ASCII, cache the parsed values in <filename>.npy and memory-map them on later reads
+        """
+        self.filename = filename
+        self.header = {}
+        # trace name -> type name (eg. 'V' or 'I')
+        self.signal_types = {}
+        self.sweep_name = None
+        self.names = []
+
+        with open(filename, 'rb') as f:
+            is_ascii = f.read(6) == b'HEADER'
+
+        if is_ascii:
+            self._read_ascii(mmap)
+        else:
+            self._read_binary()
+
+    def _read_binary(self):
+        if libpsf is None:
+            raise Exception(f"'{self.filename}' is binary PSF. Install libpsf to read it or run spectre with '-format psfascii'.")
+
+        ds = libpsf.PSFDataSet(self.filename)
+        self.sweep_name = ds.get_sweep_param_name()
+        self.names = list(ds.get_signal_names())
+        self.x = np.asarray(ds.get_sweep_values(), dtype=np.float64)
+        self._values = {name: np.asarray(ds.get_signal(name)) for name in self.names}
+        ds.close()
+
+    def _read_ascii(self, mmap):
+        cache = self.filename + '.npy'
+        cache_info = self.filename + '.json'
+        if mmap and self._load_cache(cache, cache_info):
+            return
+
+        with open(self.filename, 'r') as f:
+            # everything before VALUE is small, the values are parsed in chunks as they are read
+            head = []
+            for line in f:
+                if line.strip() == 'VALUE':
+                    break
+                head.append(line)
+            self._parse_head(''.join(head))
+            columns = [self.sweep_name] + self.names
+            matrix = np.asfortranarray(self._parse_values(f, columns))
+
+        if mmap:
+            np.save(cache, matrix)
+            with open(cache_info, 'w') as f:
+                json.dump({'columns': columns, 'header': self.header, 'signal_types': self.signal_types}, f)
+            matrix = np.load(cache, mmap_mode='r')
+
+        self._matrix = matrix
+        self._set_columns(columns)
+
+    # memory-maps the values cached by an earlier read, the trace names come from the .json next to them
+    # so the PSF file itself is not read. Returns False if there is no cache or it is older than the file
+    def _load_cache(self, cache, cache_info):
+        if not (os.path.exists(cache) and os.path.exists(cache_info)):
+            return False
+        mtime = os.path.getmtime(self.filename)
+        if os.path.getmtime(cache) < mtime or os.path.getmtime(cache_info) < mtime:
+            return False
+
+        with open(cache_info, 'r') as f:
+            info = json.load(f)
+        # caches written before the header was kept in them only hold the column names
+        if not isinstance(info, dict):
+            return False
+
+        columns = info['columns']
+        self.header = info['header']
+        self.signal_types = info['signal_types']
+        self.sweep_name = columns[0]
+        self.names = columns[1:]
+        self._matrix = np.load(cache, mmap_mode='r')
+        self._set_columns(columns)
+        return True
+
+    # reads HEADER, SWEEP and TRACE from the text before the VALUE section
+    def _parse_head(self, text):
+        bounds = {}
+        for m in re.finditer(r'^(HEADER|TYPE|SWEEP|TRACE)\s*$', text, flags=re.M):
+            bounds[m.group(1)] = (m.start(), m.end())
+
+        def section(name, props=False):
+            if name not in bounds:
+                return ''
+            start = bounds[name][1]
+            later = [b[0] for n, b in bounds.items() if b[0] > start]
+            body = text[start:min(later) if len(later) > 0 else len(text)]
+            # PROP( "key" "value" ... ) blocks span several lines which would otherwise read as entries
+            return body if props else re.sub(r'PROP\s*\((?:[^()"]|"[^"]*"|\([^()]*\))*\)', '', body)
+
+        for k, v in re.findall(r'^"([^"]*)"\s+("[^"]*"|\S+)', section('HEADER', props=True), flags=re.M):
+            self.header[k] = v.strip('"')
+
+        sweeps = re.findall(r'^"([^"]*)"\s+"([^"]*)"', section('SWEEP'), flags=re.M)
+        if len(sweeps) == 0:
+            raise Exception(f"'{self.filename}' has no sweep, only swept results (eg. tran) can be read")
+        self.sweep_name = sweeps[0][0]
+
+        # group headers ("name" GROUP n) do not carry values, their members are listed after them
+        for name, type_name in re.findall(r'^"([^"]*)"\s+"([^"]*)"', section('TRACE'), flags=re.M):
+            self.names.append(name)
+            self.signal_types[name] = type_name
+
+    # parses the VALUE section from the open file f, chunk_size bytes of lines at a time
+    # every value line is '"name" number', one line per column and point in column order
+    # returns the values as an (n_points, n_columns) array, a last point which was not completely written is dropped
+    def _parse_values(self, f, columns):
+        quoted = [f'"{c}"' for c in columns]
+        n_cols = len(columns)
+        chunks = []
+        # index of the column the next value belongs to
+        col = 0
+
+        while True:
+            lines = f.readlines(self.chunk_size)
+            if len(lines) == 0:
+                break
+            # END and blank lines
+            while len(lines) > 0 and not lines[-1].startswith('"'):
+                lines.pop()
+
+            tokens = ''.join(lines).split()
+            names = tokens[0::2]
+            expected = (quoted[col:] + quoted * (len(names) // n_cols + 1))[:len(names)]
+            if len(tokens) == 2 * len(lines) and names == expected:
+                numbers = tokens[1::2]
+            else:
+                # names with spaces or lines of other entries (eg. the header of a group), matched one by one
+                numbers = self._match_values(lines, columns, col)
+
+            try:
+                chunks.append(np.array(numbers, dtype=np.float64))
+            except ValueError:
+                raise Exception(f"'{self.filename}' contains complex or struct values which are not supported")
+            col = (col + len(numbers)) % n_cols
+
+        values = np.concatenate(chunks) if len(chunks) > 0 else np.empty(0)
+        n_points = len(values) // n_cols
+        return values[:n_points * n_cols].reshape(n_points, n_cols)
+
+    # the numbers of the value lines of the traces in columns, which must follow each other in column order
+    # starting at column col
+    def _match_values(self, lines, columns, col):
+        if any('(' in line for line in lines):
+            raise Exception(f"'{self.filename}' contains complex or struct values which are not supported")
+
+        pairs = re.findall(r'^"([^"]*)"\s+(\S+)', ''.join(lines), flags=re.M)
+        known = set(columns)
+        pairs = [p for p in pairs if p[0] in known]
+        n_cols = len(columns)
+        for k, (name, _) in enumerate(pairs):
+            if name != columns[(col + k) % n_cols]:
+                raise Exception(f"'{self.filename}' has values which are not in the order of its traces")
+        return [p[1] for p in pairs]
+
+    def _set_columns(self, columns):
+        self.x = self._matrix[:, 0]
+        self._values = {name: self._matrix[:, i] for i, name in enumerate(columns) if i > 0}
+
+    def __contains__(self, name):
+        return name in self._values
+
+    def __getitem__(self, name):
+        return self._values[name]
+
+    def find(self, wave_name):
+        """
+        Return the trace name in this file for a Simulator wave name, or None if it is not in the file
+
+        '/D' -> 'D', '/nmos/D' -> 'nmos:D' or 'nmos.D', '/I0/M0/D' -> 'I0.M0:D'
+        """
+        parts = wave_name.strip('/').split('/')
+        candidates = [wave_name, '/'.join(parts), '.'.join(parts)]
+        if len(parts) > 1:
+            candidates.append('.'.join(parts[:-1]) + ':' + parts[-1])
+
+        for c in candidates:
+            if c in self._values:
+                return c
+        return None
+
+
+# file modification times come from a coarser clock than time.time(), a file written right after newer_than can be
+# stamped slightly before it
+_mtime_slack = 0.5
+
+
+def _natural_key(path):
+    return [int(t) if t.isdigit() else t for t in re.split(r'(\d+)', path)]
+
+
+def find_psf_files(results_dir, analysis='tran', newer_than=None):
+    """
+    Find the PSF files of an analysis under a results directory, one per sweep point in sweep order
+
+    Parameters
+    ----------
+    results_dir : string
+        directory passed to resultsDir (eg. ./sim_output/<cell>)
+    analysis : string
+        analysis name, files are named <analysis>.<analysis>
+    newer_than : float
+        if given, skip files last modified before this time (eg. results left over from an earlier run).
+        Simulator passes the start of the run, so only files written by that run are found
+    """
+    files = glob.glob(os.path.join(results_dir, '**', f'{analysis}.{analysis}'), recursive=True)
+    if newer_than is not None:
+        files = [f for f in files if os.path.getmtime(f) >= newer_than - _mtime_slack]
+    return sorted(files, key=_natural_key)
+
+
+def load_psf_waves(results_dir, names, analysis='tran', mmap=True, newer_than=None):
+    """
+    Load waves from the PSF results under results_dir without SkillBridge
+
+    Parameters
+    ----------
+    results_dir : string
+        directory passed to resultsDir (eg. ./sim_output/<cell>)
+    names : list of strings
+        Simulator wave names (eg. ['/D', '/nmos/D'])
+
+    Returns
+    -------
+    x : list of np arrays, one per sweep point
+    waves : dictionary keyed on wave name of lists of np arrays, one per sweep point. Missing waves are left out.
+    signal_types : dictionary keyed on wave name of the PSF type name (eg. 'V' or 'I')
+    """
+    files = find_psf_files(results_dir, analysis, newer_than)
+    x = []
+    waves = {}
+    signal_types = {}
+
+    for fname in files:
+        psf = PSFFile(fname, mmap=mmap)
+        x.append(psf.x)
+        for name in names:
+            trace = psf.find(name)
+            if trace is None:
+                continue
+            waves.setdefault(name, []).append(psf[trace])
+            signal_types[name] = psf.signal_types.get(trace, '')
+
+    # only keep waves which were found at every sweep point
+    waves = {name: y for name, y in waves.items() if len(y) == len(files)}
+
+    return x, waves, signal_types
@@ -0,0 +1,151 @@
+# On-disk cache of simulation results keyed on a hash of everything that affects a run
+# (netlist, stimuli, model files, analysis settings and sweep values).
+# Each entry is one .npz file, the least recently used entries are removed once max_entries or max_bytes is exceeded.
+
+import numpy as np
+import hashlib
+import json
+import glob
+import os
+
+from .vp_utils import RaggedArray, stack_sweep
+
+
+# numpy values in the settings (eg. sweep values) are written out in full, str() would summarise long arrays with '...'
+def _json_default(o):
+    if isinstance(o, (np.ndarray, np.generic)):
+        return o.tolist()
+    return str(o)
+
+
+class ResultCache:
+    def __init__(self, cache_dir, max_entries=50, max_bytes=None):
+        """
+        Parameters
+        ----------
+        cache_dir : string
+            directory holding the cache entries (eg. ./sim_output/.cache)
+        max_entries : int
+            maximum number of runs to keep
+        max_bytes : int
+            maximum total size of the cache in bytes, None for no limit
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, files, settings):
+        """
+        Hash the contents of files and the settings into a cache key
+
+        Parameters
+        ----------
+        files : list of strings
+            paths of input files. '//' comment lines are skipped since netlisting writes timestamps into them
+        settings : dictionary
+            any other inputs of the run, must be json serializable
+        """
+        h = hashlib.sha256()
+        for fname in files:
+            h.update(fname.encode())
+            with open(fname, 'rb') as f:
+                for line in f:
+                    if not line.lstrip().startswith(b'//'):
+                        h.update(line)
+
+        h.update(json.dumps(settings, sort_keys=True, default=_json_default).encode())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.npz')
+
+    def store(self, key, x, waves, sweep_coords=None):
+        """
+        Store the results of a run
+
+        Parameters
+        ----------
+        x : np array, (n_sweep, n_time) array, RaggedArray or list of np arrays
+        waves : dictionary keyed on wave name of dictionaries with 'y' and 'signal_type'
+        sweep_coords : (n_sweep, n_params) array of sweep values or None
+        """
+        arrays = {}
+        meta = {'names': [], 'signal_types': []}
+
+        def add(prefix, a):
+            if isinstance(a, list):
+                a = stack_sweep(a)
+            if isinstance(a, RaggedArray):
+                arrays[prefix + '_data'] = a.data
+                arrays[prefix + '_offsets'] = a.offsets
+            else:
+                arrays[prefix] = np.asarray(a)
+
+        add('x', x)
+        for i, (name, wave) in enumerate(waves.items()):
+            add(f'y{i}', wave['y'])
+            meta['names'].append(name)
+            meta['signal_types'].append(wave.get('signal_type', ''))
+
+        if sweep_coords is not None:
+            arrays['sweep_coords'] = np.asarray(sweep_coords)
+
+        arrays['meta'] = np.asarray(json.dumps(meta))
+
+        # write to a temporary file first so an interrupted write never leaves a broken entry
+        tmp = self._path(key) + '.tmp.npz'
+        np.savez(tmp, **arrays)
+        os.replace(tmp, self._path(key))
+        self.prune()
+
+    def load(self, key):
+        """
+        Returns (x, waves, sweep_coords) for a stored run, or None on a cache miss
+        waves is a dictionary keyed on wave name of dictionaries with 'y' and 'signal_type'
+        """
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+
+        # mark as recently used
+        os.utime(path)
+
+        with np.load(path) as f:
+            def get(prefix):
+                if prefix in f:
+                    return f[prefix]
+                return RaggedArray(data=f[prefix + '_data'], offsets=f[prefix + '_offsets'])
+
+            meta = json.loads(str(f['meta']))
+            x = get('x')
+            waves = {}
+            for i, name in enumerate(meta['names']):
+                waves[name] = {'y': get(f'y{i}'), 'signal_type': meta['signal_types'][i]}
+            sweep_coords = f['sweep_coords'] if 'sweep_coords' in f else None
+
+        return x, waves, sweep_coords
+
+    def invalidate(self, key=None):
+        # removes one entry, or the whole cache if key is None
+        if key is not None:
+            if os.path.exists(self._path(key)):
+                os.remove(self._path(key))
+            return
+
+        for path in glob.glob(os.path.join(self.cache_dir, '*.npz')):
+            os.remove(path)
+
+    def prune(self):
+        # remove least recently used entries until the cache is within its limits
+        entries = sorted(glob.glob(os.path.join(self.cache_dir, '*.npz')), key=os.path.getmtime)
+        total = sum(os.path.getsize(e) for e in entries)
+
+        while len(entries) > 0:
+            too_many = self.max_entries is not None and len(entries) > self.max_entries
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if not too_many and not too_big:
+                break
+            oldest = entries.pop(0)
+            total -= os.path.getsize(oldest)
+            os.remove(oldest)
@@ -1,15 +1,109 @@
 from .Instance import _Inst, _Params, _Pins, _Pin
 from skillbridge import Workspace
 from .vp_utils import *
+from .vp_skill import define_skill
+from contextlib import contextmanager
 import numpy as np
 import os
 import atexit
 
+
+# schematic edits recorded by Schematic.batch() which are sent to Virtuoso in a few large vpBatch calls
+class _Batch:
+    def __init__(self, ws):
+        self.ws = ws
+        self.ops = []
+        # what receives the result of each op: an _Inst, a _BatchHandle or None
+        self.targets = []
+
+    def add(self, op, target=None):
+        self.ops.append(op)
+        self.targets.append(target)
+
+    def add_inst(self, inst):
+        self.add(['inst', inst.lib_name, inst.cell_name, inst.name, list(inst.vpos), inst.orient], inst)
+
+    def set_param(self, inst, key, value):
+        self.add(['param', inst.name, key, value])
+
+
+# returned by create_wire and create_pin inside a batch in place of the object they create. Once the batch is flushed
+# the object is in value and the handle can be used like it (eg. handle.name of a pin, handle[0] of a wire)
+class _BatchHandle:
+    def __init__(self, kind):
+        self.kind = kind
+        self.value = None
+        self.resolved = False
+
+    # called by the batch once the object exists in Virtuoso
+    def resolve(self, value):
+        self.value = value
+        self.resolved = True
+
+    def _get(self):
+        if not self.resolved:
+            raise Exception(f"The {self.kind} can not be used until its batch is flushed")
+        return self.value
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name in ('kind', 'value', 'resolved'):
+            raise AttributeError(name)
+        return getattr(self._get(), name)
+
+    def __getitem__(self, i):
+        return self._get()[i]
+
+    def __len__(self):
+        return len(self._get())
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def __repr__(self):
+        return f"_BatchHandle({self.kind}, {self.value if self.resolved else 'pending'})"
+
+
+# identifies a wire or note by everything it was created from, stored on it as the vpSig property
+def _signature(kind, *parts):
+    def fmt(p):
+        if isinstance(p, (list, tuple, np.ndarray)):
+            return '(' + ' '.join(fmt(v) for v in p) + ')'
+        if isinstance(p, (float, np.floating)):
+            return repr(round(float(p), 6))
+        return str(p)
+    return kind + ';' + ';'.join(fmt(p) for p in parts)
+
+
 class Schematic:
-    def __init__(self, lib_name, cell_name, ws_name="default", overwrite=False, verbose=True):
+    def __init__(self, lib_name, cell_name, ws_name="default", overwrite=False, verbose=True, pool=None, incremental=False,
+                 read_only=False, delete_untagged=False):
+        """
+        Open (or create) a schematic
+
+        Parameters
+        ----------
+        overwrite : bool
+            start from an empty schematic
+        incremental : bool
+            keep the existing schematic and only change what differs from the objects this script creates.
+            Unchanged instances, wires, pins and notes are reused, changed ones are replaced and those which
+            were not created again are deleted by save(). Takes precedence over overwrite.
+        delete_untagged : bool
+            with incremental, also delete the wires, labels and notes which were not created by an incremental run
+            (eg. drawn by hand or by a non-incremental run). They are kept by default.
+        read_only : bool
+            open the cellview for reading only (eg. to netlist and simulate it), so it can be open in several
+            Virtuoso sessions at once without fighting over the edit lock
+        """
         # ws_name = os.getenv('key')
 
-        if ws_name == "default":
+        # lease from a WorkspacePool, close() returns the workspace to the pool
+        self.pool = pool
+        if pool is not None:
+            ws = pool.lease(None if ws_name == "default" else ws_name)
+            ws.on_failover.append(self.reopen)
+
+        elif ws_name == "default":
             net_id = os.getenv('USER')
             ws = Workspace.open(workspace_id=f'{net_id}_0')
 
@@ -21,13 +115,17 @@ class Schematic:
         self.close_called = False
         atexit.register(self.cleanup)
 
-        if overwrite:
-            cv = ws.db.open_cell_view_by_type(lib_name, cell_name, "schematic",
-                                          "schematic", "w")
+        if read_only:
+            self.mode = "r"
+        elif overwrite and not incremental:
+            self.mode = "w"
         else:
-            cv = ws.db.open_cell_view_by_type(lib_name, cell_name, "schematic",
-                                          "schematic", "a")
-
+            self.mode = "a"
+        cv = ws.db.open_cell_view_by_type(lib_name, cell_name, "schematic",
+                                          "schematic", self.mode)
+        # a cellview written once is edited from then on, eg. when it is opened again after a failover
+        if self.mode == "w":
+            self.mode = "a"
 
         self.cv = cv
         self.lib_name = lib_name
@@ -39,6 +137,139 @@ class Schematic:
         self.param_vars = []
         self.cdf_ignore = []
         self.pin_nets = []
+        # the open batch, see batch()
+        self.pending = None
+
+        # objects already in the cellview which have not been created again yet, see read_existing
+        self.existing = None
+        self.delete_untagged = delete_untagged
+        # number of wires and notes created with each signature so far, see signature
+        self.sig_counts = {}
+        if incremental:
+            self.existing = self.read_existing()
+
+    def read_existing(self):
+        """
+        Read the instances, pins and shapes of the open cellview in one call
+
+        Returns
+        -------
+        dictionary with
+            'insts'  : instance name -> [lib, cell, xy, orient, names of the parameters the last run set, inst]
+            'pins'   : pin name -> [cell, xy, orient, inst]
+            'shapes' : vpSig -> list of shapes created by the create_wire or create_note call with that signature
+            'other'  : shapes without a signature (eg. drawn by hand or by a non-incremental run)
+        """
+        define_skill(self.ws, 'vpReadSchematic')
+        insts, pins, shapes = self.ws['vpReadSchematic'](self.cv)
+
+        existing = {'insts': {}, 'pins': {}, 'shapes': {}, 'other': []}
+        for name, lib, cell, xy, orient, params, inst in insts:
+            existing['insts'][name] = [lib, cell, xy, orient, params.split() if params else [], inst]
+        for name, cell, xy, orient, inst in pins:
+            existing['pins'][name] = [cell, xy, orient, inst]
+        for sig, shape in shapes:
+            if sig is None:
+                existing['other'].append(shape)
+            else:
+                existing['shapes'].setdefault(sig, []).append(shape)
+        return existing
+
+    # takes the existing object under key (if any) out of self.existing so it is not deleted as stale
+    def take_existing(self, kind, key):
+        if self.existing is None:
+            return None
+        return self.existing[kind].pop(key, None)
+
+    # signature of a wire or note, repeats of the same call get their own signature (ending in ;#n) so each
+    # takes over one existing copy
+    def signature(self, kind, *parts):
+        sig = _signature(kind, *parts)
+        n = self.sig_counts.get(sig, 0)
+        self.sig_counts[sig] = n + 1
+        return sig if n == 0 else f'{sig};#{n}'
+
+    def delete_stale(self):
+        """
+        Delete the objects of an incremental schematic which were not created again by this script and reset the
+        parameters which the previous run set but this one did not to their defaults.
+        Shapes without a signature are only deleted with delete_untagged.
+
+        Returns
+        -------
+        number of deleted objects
+        """
+        if self.existing is None:
+            return 0
+
+        ops = []
+        for i in list(self.instances.values()) + self.voltage_sources:
+            ops += i.take_reset_ops()
+        if len(ops) > 0:
+            define_skill(self.ws, 'vpBatch')
+            self.ws['vpBatch'](self.cv, ops)
+
+        stale = [e[-1] for e in self.existing['insts'].values()]
+        stale += [e[-1] for e in self.existing['pins'].values()]
+        for shapes in self.existing['shapes'].values():
+            stale += shapes
+        if self.delete_untagged:
+            stale += self.existing['other']
+        self.existing = {'insts': {}, 'pins': {}, 'shapes': {}, 'other': []}
+
+        if len(stale) == 0:
+            return 0
+
+        define_skill(self.ws, 'vpDelete')
+        self.ws['vpDelete'](stale)
+        if self.verbose:
+            print(f'Deleted {len(stale)} stale objects from {self.cell_name}')
+        return len(stale)
+
+    @contextmanager
+    def batch(self, chunk_size=2000):
+        """
+        Record schematic edits and send them to Virtuoso together when the block ends
+
+            with sch.batch():
+                for i in range(1000):
+                    n = sch.create_instance('analogLib', 'nmos4', [i*10., 0.], f'N{i}')
+                    n['w'] = '1u'
+                    sch.create_wire([n.pins.B, n.pins.B.pos + [2., 0.]], 'gnd!')
+
+        Pins of new instances can be used right away. Parameters can be set but not read until the batch is flushed.
+        create_wire/create_pin return a handle inside a batch which stands in for the wires/pin once it is flushed
+        (its value is the Virtuoso object, eg. to pass it to a SKILL call).
+
+        Parameters
+        ----------
+        chunk_size : int
+            number of edits sent per call
+        """
+        self.pending = _Batch(self.ws)
+        try:
+            yield self
+            self.flush_batch(chunk_size)
+        finally:
+            self.pending = None
+
+    # sends the edits recorded so far in the open batch
+    def flush_batch(self, chunk_size=2000):
+        b = self.pending
+        if b is None or len(b.ops) == 0:
+            return
+
+        define_skill(self.ws, 'vpBatch')
+        for start in range(0, len(b.ops), chunk_size):
+            results = self.ws['vpBatch'](self.cv, b.ops[start:start + chunk_size])
+            for target, res in zip(b.targets[start:start + chunk_size], results):
+                if isinstance(target, (_Inst, _BatchHandle)):
+                    target.resolve(res)
+                if isinstance(target, _BatchHandle) and target.kind == 'wire':
+                    self.wires.append(res)
+
+        b.ops = []
+        b.targets = []
 
     def create_instance(self, lib_name, cell_name, pos, name, rot='R0'):
         """
@@ -60,11 +291,13 @@ class Schematic:
         inst: _Inst = None # type: ignore
 
         if isinstance(pos, ConnPos):
-            inst = _Inst(self.ws, self.cv, lib_name, cell_name, pos.pos1, name, rot)
+            inst = _Inst(self.ws, self.cv, lib_name, cell_name, pos.pos1, name, rot, self.pending,
+                         self.take_existing('insts', name))
             self.create_wire([pos.external_pin, inst.pins[pos.internal_pin]], label=pos.net_name, label_offset=pos.label_offset)
         elif isinstance(pos, list) or isinstance(pos, np.ndarray):
             if len(pos) == 2:
-                inst = _Inst(self.ws, self.cv, lib_name, cell_name, pos, name, rot)
+                inst = _Inst(self.ws, self.cv, lib_name, cell_name, pos, name, rot, self.pending,
+                             self.take_existing('insts', name))
         else:
             print('Pos parameter must be:')
             print('\tan xy coordinate represented by an array of length 2')
@@ -89,16 +322,32 @@ class Schematic:
             else:
                 pos.append(list(transform(positions[i])))
 
-        w = self.ws.sch.create_wire(self.cv, mode, "full", pos, snap_spacing,
-                                    snap_spacing, 0.0)
-
+        l_pos = None
         if label != None:
             l_pos = pos[0]
             if label_offset != None:
                 label_offset = transform(label_offset)
                 l_pos = np.asarray(l_pos) + np.asarray(label_offset)
                 l_pos = list(l_pos)
-            self.ws.sch.create_wire_label(
+
+        sig = None
+        if self.existing is not None:
+            sig = self.signature('wire', mode, pos, label, l_pos)
+            kept = self.take_existing('shapes', sig)
+            if kept is not None:
+                self.wires.append(kept)
+                return kept
+
+        if self.pending is not None:
+            handle = _BatchHandle('wire')
+            self.pending.add(['wire', mode, pos, snap_spacing, label, l_pos, sig], handle)
+            return handle
+
+        w = self.ws.sch.create_wire(self.cv, mode, "full", pos, snap_spacing,
+                                    snap_spacing, 0.0)
+
+        if label != None:
+            w_label = self.ws.sch.create_wire_label(
                 self.cv,
                 w[0],
                 l_pos,
@@ -109,6 +358,11 @@ class Schematic:
                 snap_spacing,
                 None,
             )
+            if sig is not None:
+                self.tag([w_label], sig)
+
+        if sig is not None:
+            self.tag(w, sig)
 
         self.wires.append(w)
         return w
@@ -120,7 +374,8 @@ class Schematic:
                        p_name,
                        n_name="gnd!",
                        rotation="R0"):
-        V_src = _Inst(self.ws, self.cv, "analogLib", type, pos, name, rotation)
+        V_src = _Inst(self.ws, self.cv, "analogLib", type, pos, name, rotation, self.pending,
+                      self.take_existing('insts', name))
 
         # vdd = _Inst(self.ws, self.cv, "analogLib", 'vdd', pos + [0.,4.], 'vdd', rotation)
         
@@ -146,8 +401,25 @@ class Schematic:
 
     def create_note(self, note, pos, size=0.125):
         pos = transform(pos)
-        self.ws.sch.create_note_label(self.cv, list(pos), note, "lowerLeft",
-                                      "R0", "fixed", size, "normalLabel")
+
+        sig = None
+        if self.existing is not None:
+            sig = self.signature('note', note, pos, size)
+            if self.take_existing('shapes', sig) is not None:
+                return
+
+        if self.pending is not None:
+            self.pending.add(['note', note, list(pos), size, sig])
+            return
+        n = self.ws.sch.create_note_label(self.cv, list(pos), note, "lowerLeft",
+                                          "R0", "fixed", size, "normalLabel")
+        if sig is not None:
+            self.tag([n], sig)
+
+    # marks objects with their signature so the next incremental run can reuse them
+    def tag(self, objs, sig):
+        define_skill(self.ws, 'vpTag')
+        self.ws['vpTag'](objs, sig)
 
     def create_pin(self, name, direction, pos, rot='R0'):
         if isinstance(pos, ConnPos):
@@ -171,14 +443,35 @@ class Schematic:
                 print(f"Creation of Pin {name} Failed! \ndirection should be one of: [input, output, inputOutput]. got {direction}")
             return 0
 
+        if name not in self.pin_nets:
+            self.pin_nets.append(name)
+
+        existing = self.take_existing('pins', name)
+        if existing is not None:
+            e_cell, e_xy, e_orient, e_pin = existing
+            if e_cell == cell_name and e_orient == rot and np.allclose(e_xy, pos):
+                return e_pin
+            self.ws.db.delete_object(e_pin)
+
+        if self.pending is not None:
+            handle = _BatchHandle('pin')
+            self.pending.add(['pin', cell_name, name, direction, list(pos), rot], handle)
+            return handle
+
         inputCVId = self.ws.db.open_cell_view("basic", cell_name, "symbol")
         p_id = self.ws.sch.create_pin(self.cv, inputCVId, name, direction,
                                       None, list(pos), rot)
 
-        if name not in self.pin_nets:
-            self.pin_nets.append(name)
         return p_id
 
+    # opens the cellview again after the pool moved this schematic to another Virtuoso
+    # instances and wires created before the failover are not carried over
+    def reopen(self, ws):
+        self.cv = ws.db.open_cell_view_by_type(self.lib_name, self.cell_name, "schematic",
+                                          "schematic", self.mode)
+        if self.existing is not None:
+            self.existing = self.read_existing()
+
     def add_param_vars(self, vars):
         self.param_vars += vars
 
@@ -188,7 +481,29 @@ class Schematic:
     def redraw(self):
         self.ws.hi.redraw()
 
+    # sends the buffered parameter writes of every instance in chunks of chunk_size
+    def flush_params(self, chunk_size=2000):
+        ops = []
+        for i in list(self.instances.values()) + self.voltage_sources:
+            ops += i.take_param_ops()
+
+        if len(ops) == 0:
+            return
+
+        define_skill(self.ws, 'vpBatch')
+        for start in range(0, len(ops), chunk_size):
+            self.ws['vpBatch'](self.cv, ops[start:start + chunk_size])
+
     def do_cdf_callbacks(self):
+        """
+        Run the CDF callbacks of every instance and check that the applied parameters stuck
+
+        Returns
+        -------
+        list of mismatches, empty if every applied parameter matches its calculated value. Each mismatch is a dictionary
+        with 'instance', 'param', 'applied' and 'calculated'
+        """
+        self.flush_params()
 
         # self.ws['CCSinvokeCdfCallbacks'](f"{self.cv} ?callInitProc t ?useInstCDF t")
         self.ws['CCSinvokeCdfCallbacks'](self.cv, debug=True, callInitProc=True,useInstCDF=True)
@@ -199,40 +514,46 @@ class Schematic:
         # CDF callbacks use the user applied parameters to calculate the actual parameters
         # Sometimes user applied parameters don't stick
         # let the user know if that happens:
+        queries = []
+        applied = []
         for _, i in self.instances.items():
             for a_p_name, a_p_value in i.applied_params.items():
                 if a_p_value == '' or a_p_value in self.param_vars or a_p_value in self.cdf_ignore:
-                    break
-                
-                calc_val = i.params[a_p_name].value
-                app_val = a_p_value
-
-                # convert strings to floats for comparison
-                if isinstance(app_val, str):
-                    app_val = convert_str_to_num(app_val)
-
-                if isinstance(calc_val, str):
-                    calc_val = convert_str_to_num(calc_val)
-
-                if isinstance(app_val, str):
-                    try:
-                        if calc_val != app_val:
-                            if self.verbose:
-                                print(f'Error: Calculated Parameter not equal to Applied Parameter for {a_p_name} on {i.name}.')
-                                print(f'{i.params[a_p_name].value} != {a_p_value}')
-                            return 1
-                    
-                        elif not np.isclose(calc_val, app_val):
-                            if self.verbose:
-                                print(f'Error: Calculated Parameter not equal to Applied Parameter for {a_p_name} on {i.name}.')
-                                print(f'{i.params[a_p_name].value} != {a_p_value}')
-                            return 1
-                    except:
-                        print(f'Could not convert {calc_val} or {app_val} to float')
-        
-        return 0
+                    continue
+                queries.append([i.name, a_p_name])
+                applied.append(a_p_value)
+
+        if len(queries) == 0:
+            return []
+
+        define_skill(self.ws, 'vpGetParams')
+        calculated = self.ws['vpGetParams'](self.cv, queries)
+
+        # compare numerically where both sides convert to numbers, as strings otherwise
+        app_nums = np.asarray([to_float(v) for v in applied])
+        calc_nums = np.asarray([to_float(v) for v in calculated])
+        numeric = ~np.isnan(app_nums) & ~np.isnan(calc_nums)
+
+        ok = np.zeros(len(queries), dtype=bool)
+        # relative only, an absolute tolerance would let nm and fF sized mismatches through
+        ok[numeric] = np.isclose(calc_nums[numeric], app_nums[numeric], rtol=1e-6, atol=0)
+        for k in np.flatnonzero(~numeric):
+            ok[k] = str(calculated[k]) == str(applied[k])
+
+        mismatches = []
+        for k in np.flatnonzero(~ok):
+            mismatches.append({'instance': queries[k][0], 'param': queries[k][1], 'applied': applied[k], 'calculated': calculated[k]})
+            if self.verbose:
+                print(f'Error: Calculated Parameter not equal to Applied Parameter for {queries[k][1]} on {queries[k][0]}.')
+                print(f'{calculated[k]} != {applied[k]}')
+
+        return mismatches
 
     def save(self, do_callbacks=True):
+        self.flush_batch()
+        self.flush_params()
+        self.delete_stale()
+
         rv = 0
         if do_callbacks and self.do_cdf_callbacks():
             rv = 1
@@ -249,5 +570,7 @@ class Schematic:
         self.close_called = True
         if purge:
             self.ws.db.purge(self.cv)
+        if self.pool is not None:
+            self.ws.on_failover.remove(self.reopen)
         self.ws.close()
         
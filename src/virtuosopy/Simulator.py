@@ -8,16 +8,79 @@ from matplotlib.lines import Line2D
 import matplotlib.colors as mcolors
 from .Instance import _Pin
 from .vp_utils import *
+from .vp_skill import define_skill
+from .PSFReader import load_psf_waves
+from .ResultCache import ResultCache
+from .SpectreBackend import SpectreBackend
+from .Sweep import Sweep, Product, labelled
+from .Stimuli import StimulusCompiler
+from .WaveStore import WaveStore, window_indices
+from .Decimation import MinMaxPyramid
 
 # from skillbridge.client.translator import Symbol
 from skillbridge.client.hints import Symbol
 import numpy as np
+import itertools
+import hashlib
+import json
+import io
 import os
 
 import ipywidgets as w
 from IPython.display import display
 
 import time
+import asyncio
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+# one lock per workspace (by id), SkillBridge connections can not be used from two threads at once
+_workspace_locks = {}
+_workspace_locks_lock = threading.Lock()
+
+# workspace (by id) -> id of the simulator whose OCEAN session is set up in it. OCEAN keeps one session per workspace,
+# so simulators sharing a workspace set theirs up again before they run (see setup_session)
+_workspace_owners = {}
+
+
+# registers sim.on_failover with a pooled workspace without keeping the simulator alive,
+# the callback is removed again when the simulator is garbage collected
+def _register_failover(sim, callbacks):
+    ref = weakref.ref(sim)
+
+    def on_failover(ws):
+        s = ref()
+        if s is not None:
+            s.on_failover(ws)
+
+    callbacks.append(on_failover)
+    weakref.finalize(sim, _unregister_failover, callbacks, on_failover)
+
+
+def _unregister_failover(callbacks, fn):
+    if fn in callbacks:
+        callbacks.remove(fn)
+
+
+# a custom wave entry in Simulator.waves
+# 'y' is calculated from the input waves on first access and kept until the next run invalidates it
+class _CustomWave(dict):
+    def __init__(self, sim, name):
+        super().__init__()
+        self.sim = sim
+        self.name = name
+
+    def __getitem__(self, key):
+        if key == 'y' and not dict.__contains__(self, 'y'):
+            dict.__setitem__(self, 'y', self.sim.calc_custom_wave(self.name))
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        if key in self or key == 'y':
+            return self[key]
+        return default
+
 
 class Simulator:
     '''
@@ -27,37 +90,53 @@ class Simulator:
      -retieves data from Virtuoso in a readable format\n
      -plotting\n
     '''
-    def __init__(self, sch, model_files = None, view='schematic', show_netlist = False, verbose=True):
+    def __init__(self, sch, model_files = None, view='schematic', show_netlist = False, verbose=True, results_backend='skillbridge', results_dir=None, renetlist='always'):
         self.sch = sch
+        self.view = view
         self.verbose = verbose
         self.temp = 27
-
-        # set simulator
-        self.sch.ws['simulator'](Symbol('spectre'))
-
-        self.sch.ws['design'](sch.lib_name, sch.cell_name, view, 'w')
-        self.sch.ws['resultsDir'](os.getcwd() + f'/sim_output/{self.sch.cell_name}')
-
-        if sch.ws['createNetlist'](recreate_all=True, display=show_netlist) == None:
-            if self.verbose:
-                print('ERROR netlist not created')
-
+        # design variable name -> value, see set_var()
+        self.design_vars = {}
+
+        # where waves are extracted from after a run:
+        # 'skillbridge' - through the OCEAN data access functions in Virtuoso
+        # 'psf' - read directly from the PSF files in results_dir (spectre is told to write PSF-ASCII)
+        if results_backend not in ['skillbridge', 'psf']:
+            raise Exception(f"results_backend must be 'skillbridge' or 'psf', found {results_backend}")
+        self.results_backend = results_backend
+
+        # defaults to ./sim_output/<cell>, simulators of the same cell running side by side need their own
+        if results_dir is None:
+            results_dir = os.getcwd() + f'/sim_output/{self.sch.cell_name}'
+        self.results_dir = os.path.abspath(results_dir)
+
+        # pull whole drVectors across in chunks instead of one get_elem call per sample
+        self.bulk_transfer = True
+        self.bulk_chunk_size = 100000
+
+        # 'always' - renetlist the whole hierarchy (default)
+        # 'auto' - reuse the netlist in results_dir if no cellview of the design changed since it was created,
+        #          otherwise only renetlist the changed cells
+        if renetlist not in ['auto', 'always']:
+            raise Exception(f"renetlist must be 'auto' or 'always', found {renetlist}")
+        self.renetlist = renetlist
+
+        self.model_files = []
         if model_files is not None:
-            model_files = [os.path.abspath(m) for m in model_files]
-            self.sch.ws['modelFile'](*model_files)
-
+            self.model_files = [os.path.abspath(m) for m in model_files]
 
-        # analysis order in case of multiple analysis
-        self.sch.ws['envOption'](Symbol('analysisOrder'), ['tran'])
+        # saved wave name -> 'v' or 'i', used to write the save statement for the spectre backend
+        self.saves = {}
+        # stimulus file written by apply_stims
+        self.stim_filename = None
 
-        # performance options
-        self.sch.ws['option'](Symbol('nthreads'), '25',\
-                              Symbol('multithread'), 'on')
+        # set simulator, design, results directory and options
+        self.setup_session()
+        # a pooled workspace which failed over to another Virtuoso starts with an empty session
+        if getattr(self.sch, 'pool', None) is not None:
+            _register_failover(self, self.sch.ws.on_failover)
 
-        self.sch.ws['option']('?categ', Symbol('turboOpts'),\
-                            Symbol('numThreads'), '25',\
-                            Symbol('mtOption'), 'Manual',\
-                            Symbol('apsplus'), 't')
+        self.netlist(show_netlist)
 
         # the time values for each simulation
         self.x = []
@@ -73,6 +152,8 @@ class Simulator:
         # custom functions
         self.custom_wave_names = []
         self.cust_data_types = []
+        # custom waves currently being calculated, to catch circular dependencies
+        self.calculating = []
 
         # spectre stimuli
         self.bit_stim_defaults = {'val0' : 0, 'val1' : 1.2, 'period' : 1e-9, 'rise' : 200e-12, 'fall' : 200e-12}
@@ -83,6 +164,89 @@ class Simulator:
         # paramter analysis sets
         self.param_sets = None
 
+        # sweep values of each sweep point (n_sweep, n_params) after a parametric run
+        self.sweep_coords = None
+
+        # time the last run started, used to skip stale result files
+        self.run_start = None
+
+        # the applied stimuli and the source line written for each, see apply_stims
+        self.stims = {}
+        self.stim_lines = {}
+        # the patterns of apply_stim_patterns, None when plain stimuli are applied
+        self.stim_patterns = None
+
+        # the sweep spec of the last run (eg. Product or LatinHypercube), see labelled()
+        self.sweep = None
+
+        # runs spectre directly instead of through OCEAN, see use_spectre()
+        self.spectre = None
+
+        # waves with more samples than this are plotted from a min/max envelope, refined when zooming in
+        self.plot_max_points = 4000
+        # (wave name, sweep index) -> MinMaxPyramid and wave name -> (min, max), rebuilt after every run
+        self.pyramids = {}
+        self.wave_ranges = {}
+        # (ax, line, pyramid) of the decimated lines of the last plot
+        self.decimated = []
+
+        # optional memory-mapped storage of the waves, see enable_wave_store()
+        self.wave_store = None
+
+        # optional result cache, see enable_cache()
+        self.cache = None
+        self.cache_key_last = None
+
+    # sets up the OCEAN session of this simulator, followed by the analysis, saves and stimuli set so far
+    # (OCEAN keeps one session per workspace, see on_failover)
+    def setup_session(self):
+        ws = self.sch.ws
+        _workspace_owners[id(ws)] = id(self)
+        ws['simulator'](Symbol('spectre'))
+
+        ws['design'](self.sch.lib_name, self.sch.cell_name, self.view, 'w')
+        ws['resultsDir'](self.results_dir)
+
+        if len(self.model_files) > 0:
+            ws['modelFile'](*self.model_files)
+
+        if self.results_backend == 'psf':
+            ws['envOption'](Symbol('userCmdLineOption'), '-format psfascii')
+
+        # analysis order in case of multiple analysis
+        ws['envOption'](Symbol('analysisOrder'), ['tran'])
+
+        # performance options
+        ws['option'](Symbol('nthreads'), '25',\
+                     Symbol('multithread'), 'on')
+
+        ws['option']('?categ', Symbol('turboOpts'),\
+                     Symbol('numThreads'), '25',\
+                     Symbol('mtOption'), 'Manual',\
+                     Symbol('apsplus'), 't')
+
+        for name, value in self.design_vars.items():
+            ws['desVar'](name, value)
+
+        if hasattr(self, 'duration'):
+            self.tran(self.duration, self.errpreset)
+
+        for name, signal_type in self.saves.items():
+            ws['save'](Symbol(signal_type), name)
+
+        if self.stim_filename is not None:
+            ws['stimulusFile'](self.stim_filename)
+
+    # called by the WorkspacePool after the workspace moved to another Virtuoso
+    def on_failover(self, ws):
+        self.setup_session()
+
+    # called before changing the OCEAN session, if it was set up for another simulator of the same workspace it now
+    # matches neither of them and is set up again by the next run
+    def touch_session(self):
+        if _workspace_owners.get(id(self.sch.ws)) != id(self):
+            _workspace_owners.pop(id(self.sch.ws), None)
+
     def tran(self, duration, errpreset=None):
         if isinstance(duration, str):
             duration = convert_str_to_num(duration)
@@ -91,6 +255,7 @@ class Simulator:
 
         self.errpreset = errpreset
 
+        self.touch_session()
         if self.errpreset is None:
             self.sch.ws['analysis'](Symbol('tran'), '?start', '0', '?stop', duration, '?errpreset', 'moderate')
         elif self.errpreset == 'liberal' or self.errpreset == 'conservative' or self.errpreset == 'moderate':
@@ -102,8 +267,15 @@ class Simulator:
 
     def set_temp(self, temp):
         self.temp = temp
+        self.touch_session()
         self.sch.ws['option'](Symbol('temp'), f'{temp}')
 
+    # sets a design variable for every run, swept parameters (p_values) override it for their run
+    def set_var(self, name, value):
+        self.design_vars[name] = value
+        self.touch_session()
+        self.sch.ws['desVar'](name, value)
+
 
 # stimulus file example:
 # cat /<path to netlist>/_graphical_stimuli.scs
@@ -116,47 +288,122 @@ class Simulator:
 # spectre snipit using stimulus file:
     # stimulusFile( ?xlate nil
     #     "/<path to netlist>/_graphical_stimuli.scs")
+    # pwl 'wave' may also be given as (time, value) np arrays (see create_wave_arrays), long waves are then written to
+    # data files under <results_dir>/stimuli which the sources read with file=
+    # the stimulus file is only rewritten and registered again when a source line changed, returns the changed names
     def apply_stims(self, stims):
-        stim_filename = os.getcwd() + f'/sim_output/{self.sch.cell_name}/graphical_stimuli.scs'
-
-        stim_functions = ['bit', 'pwl', 'dc']
-
-        with open(stim_filename, 'w') as f:
-            for name, s in stims.items():
-                if 'function' not in s:
-                    s['function'] = 'bit'
-
-                if 'type' not in s:
-                    s['type'] = 'v'
-                elif s['type'] not in ['i', 'v']:
-                    raise(Exception(f"stimulus 'type' must be 'i' or 'v', found {s['type']}"))
-
-                if 'current' in s:
-                    s['voltage'] = s['current']
-
-                if s['function'] == 'bit':
-                    for d in self.bit_stim_defaults.keys():
-                        if d not in s:
-                            s[d] = self.bit_stim_defaults[d]
-                    
-                    f.write(f"""_{s['type']}{name} ({name} 0) {s['type']}source data="{s['data']}" rptstart=1 rpttimes=0 val1={s['val1']} val0={s['val0']} rise={s['rise']} fall={s['fall']} period={s['period']} type=bit\n""")
-                elif s['function'] == 'pwl':
-                    f.write(f"""_{s['type']}{name} ({name} 0) {s['type']}source wave=\\[ {s['wave']} \\] type=pwl\n""")
-                elif s['function'] == 'dc':
-                    f.write(f"""_{s['type']}{name} ({name} 0) {s['type']}source dc={s['voltage']} type=dc\n""")
-                else:
-                    print(f"Unknown stim function '{s['function']}'. Please use one of: \n\t{stim_functions}")
+        compiler = StimulusCompiler(self.results_dir + '/stimuli', self.bit_stim_defaults, verbose=self.verbose)
+        lines = {}
+        for name, s in stims.items():
+            buf = io.StringIO()
+            if compiler.write(buf, name, s):
+                lines[name] = buf.getvalue()
+
+        self.stims = dict(stims)
+        self.stim_patterns = None
+        return self.write_stim_lines(lines)
+
+    # writes the source lines keyed on net name to the stimulus file if any of them changed
+    def write_stim_lines(self, lines):
+        stim_filename = self.results_dir + '/graphical_stimuli.scs'
+
+        changed = [name for name in lines if self.stim_lines.get(name) != lines[name]]
+        changed += [name for name in self.stim_lines if name not in lines]
+
+        if len(changed) == 0 and self.stim_filename == stim_filename and os.path.isfile(stim_filename):
+            return []
+
+        # written to a temporary file first so the stimulus file is never seen half written
+        tmp = stim_filename + '.tmp'
+        with open(tmp, 'w', buffering=1 << 20) as f:
+            for line in lines.values():
+                f.write(line)
+        os.replace(tmp, stim_filename)
+        self.stim_lines = lines
+        self.stim_filename = stim_filename
 
         # self.sch.ws['hlcheck']('0') #not sure what this does. works without
         
+        self.touch_session()
         self.sch.ws['stimulusFile'](stim_filename)
+        return changed
+
+    def apply_stim_patterns(self, patterns):
+        """
+        Apply several stimulus patterns at once, the design variable vp_pattern selects which one drives the circuit
+        (see run_patterns)
+
+        Parameters
+        ----------
+        patterns : list of stimuli dictionaries, each in the format of apply_stims
+        """
+        compiler = StimulusCompiler(self.results_dir + '/stimuli', self.bit_stim_defaults, verbose=self.verbose)
+        lines = compiler.compile_patterns(patterns, 'vp_pattern')
+        self.stims = {}
+        self.stim_patterns = patterns
+        return self.write_stim_lines(lines)
+
+    def run_patterns(self, patterns, plot_in_v=False, p_values=None):
+        """
+        Simulate every stimulus pattern in one sweep instead of one run per pattern
+
+        Parameters
+        ----------
+        patterns : list of stimuli dictionaries, each in the format of apply_stims
+        p_values : dictionary or Sweep
+            further parameters, every pattern is run at every point
+
+        Returns
+        -------
+        0 on success, None on failure. Results have one sweep point per pattern (pattern major when p_values is given),
+        labelled('/out').sel(vp_pattern=k) returns the results of patterns[k]
+        """
+        self.apply_stim_patterns(patterns)
+        k = np.arange(len(patterns), dtype=np.float64)
+
+        if p_values is None:
+            return self.run(plot_in_v, Product(vp_pattern=k))
+
+        if not isinstance(p_values, Sweep):
+            p_values = Sweep(p_values.keys(), paramset_coords(p_values))
+
+        if isinstance(p_values, Product):
+            sweep = Product(vp_pattern=k, **p_values.values)
+        else:
+            n = len(p_values)
+            sweep = Sweep(['vp_pattern'] + p_values.names, np.column_stack((np.repeat(k, n), np.tile(p_values.coords, (len(k), 1)))))
+        return self.run(plot_in_v, sweep)
+
+    def update_stims(self, **stims):
+        """
+        Change some of the applied stimuli, keeping the others
+
+            sim.update_stims(In={'function' : 'dc', 'voltage' : 0.6})
+
+        Parameters
+        ----------
+        stims : stimulus dictionaries keyed on net name (as in apply_stims), None removes the stimulus of that net
+
+        Returns
+        -------
+        names of the stimuli which changed, the stimulus file is left alone if there are none
+        """
+        merged = dict(self.stims)
+        for name, s in stims.items():
+            if s is None:
+                merged.pop(name, None)
+            else:
+                merged[name] = s
+        return self.apply_stims(merged)
 
     def save_pin(self, pin, signal_type):
         pinfname = pin
         if type(pin) == _Pin:
             pinfname = pin.fname
 
+        self.touch_session()
         self.sch.ws['save'](Symbol(signal_type), pinfname)
+        self.saves[pinfname] = signal_type
 
         return pinfname
 
@@ -180,8 +427,10 @@ class Simulator:
                 print("Please provide a net in the form of a string.")
             return
 
+        self.touch_session()
         self.sch.ws['save'](Symbol('v'), net)
         net_name = f'/{net}'
+        self.saves[net_name] = 'v'
         self.waves[net_name] = {}
         self.waves[net_name]['type'] = sig_type
 
@@ -195,11 +444,22 @@ class Simulator:
 
     # enables the user to provide a custom function for calculating things such as resistance
     # fn - a funciton which will recieve an array of np arrays of the requested pins
-    def track_custom(self, fn, name, y_label, signal_types, pins, group=None):
+    # pins - nets, pins or the names of other custom waves, which are calculated first when needed
+    # batched - fn is called once for all sweep points with 2-D (sweep x time) arrays of the requested pins followed by
+    #           the 2-D x array, and must return a 2-D array. Otherwise fn is called once per sweep point.
+    # the wave is only calculated when waves[name]['y'] is first read after a run
+    def track_custom(self, fn, name, y_label, signal_types, pins, group=None, batched=False):
+        if name in self.custom_wave_names:
+            raise Exception(f'{name} is already a custom wave name.')
+
         # holds the full names of the pins needed in the function
         pin_fns = []
         # track the pins required for the custom funciton
         for signal_type, pin in zip(signal_types, pins):
+            # other custom waves are calculated, not saved
+            if isinstance(pin, str) and pin in self.custom_wave_names:
+                pin_fns.append(pin)
+                continue
             
             pinfname = self.save_pin(pin, signal_type)
 
@@ -209,15 +469,13 @@ class Simulator:
                 self.waves[pinfname]['no plot'] = True
             pin_fns.append(pinfname)
 
-        if name in self.custom_wave_names:
-            raise Exception(f'{name} is already a custom wave name.')
-
         self.custom_wave_names.append(name)
-        self.waves[name] = {}
+        self.waves[name] = _CustomWave(self, name)
         self.waves[name]['pins'] = pin_fns
         self.waves[name]['type'] = y_label
         self.waves[name]['data type'] = 'custom'
         self.waves[name]['fn'] = fn
+        self.waves[name]['batched'] = batched
 
         if y_label not in self.cust_data_types:
             self.cust_data_types.append(y_label)
@@ -227,10 +485,32 @@ class Simulator:
             if group not in self.groups:
                 self.groups.append(group)
 
-    # builds a list of waves needed for each custom function and calls them
+    # drops the stored custom wave results so they are recalculated from the latest run when next read
+    def invalidate_custom(self):
+        for cw in self.custom_wave_names:
+            self.waves[cw].pop('y', None)
+        # the plot caches belong to the old results as well
+        self.pyramids = {}
+        self.wave_ranges = {}
+
+    # calculates every custom wave now instead of on first access
     def calc_custom(self):
+        self.invalidate_custom()
         for cw in self.custom_wave_names:
-            self.waves[cw]['y'] = []
+            self.waves[cw]['y']
+
+    # builds a list of waves needed for a custom function and calls it
+    # reading 'y' of an input which is itself a custom wave calculates that wave first
+    def calc_custom_wave(self, cw):
+        if cw in self.calculating:
+            raise Exception(f"Custom wave '{cw}' depends on itself")
+
+        self.calculating.append(cw)
+        try:
+            if self.waves[cw]['batched']:
+                return self.calc_custom_batched(cw)
+
+            y_data = []
             for x_i in range(len(self.x)):
                 wave_y_data = []
                 for p in self.waves[cw]['pins']:
@@ -239,12 +519,49 @@ class Simulator:
             
                 wave_y_data.append(self.x[x_i])
                 y = self.waves[cw]['fn'](wave_y_data)
-                self.waves[cw]['y'].append(y)
+                y_data.append(y)
+            return y_data
+        finally:
+            self.calculating.remove(cw)
+
+    # calls a batched custom function on stacked (sweep x time) arrays
+    # sweep points with different time grids cannot be stacked, so those are passed in one row at a time
+    def calc_custom_batched(self, cw):
+        fn = self.waves[cw]['fn']
+        waves_y = [self.waves[p]['y'] for p in self.waves[cw]['pins']]
+
+        if self.param_sets == None:
+            y = fn([np.atleast_2d(y_i) for y_i in waves_y] + [np.atleast_2d(self.x)])
+            return np.asarray(y)[0]
+
+        if not any(isinstance(a, RaggedArray) for a in waves_y + [self.x]):
+            return np.asarray(fn([np.asarray(y_i) for y_i in waves_y] + [np.asarray(self.x)]))
+
+        rows = []
+        for x_i in range(len(self.x)):
+            y = fn([np.atleast_2d(y_i[x_i]) for y_i in waves_y] + [np.atleast_2d(self.x[x_i])])
+            rows.append(np.asarray(y)[0])
+        return stack_sweep(rows)
+
+    # warns if a wave tracked as a current came back as a voltage
+    def check_signal_type(self, name):
+        if self.waves[name]['signal_type'] == 'V' and self.waves[name]['type'] != 'Voltage':
+            print(f"Net '{name}' was expected to be a current, but a voltage was returned instead. To track a current use track_pin() on a pin attached to an instance/symbol. \n\tnmos = sch.create_instance('analogLib', 'nmos4', [0.,0.], 'nmos')\n\ts.track_pin(nmos.pins.D)")
+            self.waves[name]['type'] = 'Voltage'
 
     # calls getData to extract the waves from spectre
     def extract_waves(self):
         if len(self.waves) == 0:
             return None
+
+        if self.spectre is not None:
+            if not self.spectre.ok:
+                self.run_ok = False
+                return
+            return self.load_results(self.spectre.run_dir, newer_than=self.run_start)
+
+        if self.results_backend == 'psf':
+            return self.load_results(newer_than=self.run_start)
         
         waveforms = []
         extracted_names = []
@@ -263,9 +580,7 @@ class Simulator:
                 waveforms.append(w)
                 extracted_names.append(name)
                 self.waves[name]['signal_type'] = w.leaf_signal_type_name
-                if self.waves[name]['signal_type'] == 'V' and self.waves[name]['type'] != 'Voltage':
-                    print(f"Net '{name}' was expected to be a current, but a voltage was returned instead. To track a current use track_pin() on a pin attached to an instance/symbol. \n\tnmos = sch.create_instance('analogLib', 'nmos4', [0.,0.], 'nmos')\n\ts.track_pin(nmos.pins.D)")
-                    self.waves[name]['type'] = 'Voltage'
+                self.check_signal_type(name)
 
             else:
                 # we were not able to get any waves, simulation likely failed
@@ -288,9 +603,11 @@ class Simulator:
         # if there are no param sets, the length of the list is 1
         if self.param_sets == None:
             y, x = self.waveform_to_vector(waveforms)
+            self.sweep_coords = None
         else:
             y, x = self.param_waveform_to_vector(waveforms)
-            
+            # one column per swept parameter, as load_results gives
+            self.sweep_coords = paramset_coords(self.param_sets)
 
         self.x = x
 
@@ -299,29 +616,84 @@ class Simulator:
 
         return self.waves
 
+    # reads the tracked waves straight from the PSF files on disk, no SkillBridge traffic is needed
+    # results_dir defaults to this simulator's results directory, so results can be reloaded after the run
+    def load_results(self, results_dir=None, newer_than=None):
+        if results_dir is None:
+            results_dir = self.results_dir
+
+        names = [name for name in self.waves if 'fn' not in self.waves[name]]
+        x, waves, signal_types = load_psf_waves(results_dir, names, newer_than=newer_than)
+        self.run_ok = True
+
+        if len(x) == 0:
+            self.run_ok = False
+            if self.verbose:
+                print(f'Error: No PSF results found in {results_dir}')
+            return
+
+        for name in names:
+            if name not in waves:
+                self.run_ok = False
+                if self.verbose:
+                    print(f'Error: Unable to extract {name}. Does it exist? Check that it is saved or try track_net')
+                self.waves.pop(name)
+                continue
+
+            self.waves[name]['signal_type'] = signal_types[name]
+            self.check_signal_type(name)
+
+            if self.param_sets == None:
+                self.waves[name]['y'] = waves[name][0]
+            else:
+                self.waves[name]['y'] = stack_sweep(waves[name])
+
+        if self.param_sets == None:
+            self.x = x[0]
+            self.sweep_coords = None
+        else:
+            self.x = stack_sweep(x)
+            self.sweep_coords = paramset_coords(self.param_sets)
+
+        # custom waves and plot envelopes of the previous results
+        self.invalidate_custom()
+        return self.waves
+
+    # converts a drVector into a numpy array, complex for complex vectors (eg. ac results)
+    # with bulk_transfer the vector is fetched bulk_chunk_size elements at a time through a SKILL helper,
+    # otherwise each element is fetched with its own get_elem call
+    def vector_to_array(self, vec):
+        length = self.sch.ws.dr.vector_length(vec)
+
+        if not self.bulk_transfer:
+            elems = []
+            for i in range(length):
+                elems.append(self.sch.ws.dr.get_elem(vec, i))
+            return np.asarray(elems)
+
+        define_skill(self.sch.ws, 'vpDrVectorSlice')
+
+        chunks = []
+        for start in range(0, length, self.bulk_chunk_size):
+            end = min(start + self.bulk_chunk_size, length)
+            chunks.append(self.sch.ws['vpDrVectorSlice'](vec, start, end))
+
+        # same conversion as the per element path, so both give identical arrays
+        return np.asarray(list(itertools.chain.from_iterable(chunks)))
+
     # used in extract_waves()
     def waveform_to_vector(self, waveforms):
         vectors = []
-        x_vec = []
-        
+
         # convert the y data in each wave to numpy array
         for wave in waveforms:
             y_wave = self.sch.ws.dr.get_waveform_y_vec(wave)
-
-            y_vec = []
-            # each timestep
-            for i in range(self.sch.ws.dr.vector_length(y_wave)):
-                y_vec.append(self.sch.ws.dr.get_elem(y_wave, i))
-
-            vectors.append(np.asarray(y_vec))
+            vectors.append(self.vector_to_array(y_wave))
 
         # x vector is same for all these y vector
         x_wave = self.sch.ws.dr.get_waveform_x_vec(waveforms[0])
-        
-        for i in range(self.sch.ws.dr.vector_length(x_wave)):
-            x_vec.append(self.sch.ws.dr.get_elem(x_wave, i))
-        
-        return vectors, np.asarray(x_vec)
+
+        return vectors, self.vector_to_array(x_wave)
 
 
     def unpack_nested_waveform(self, waveform):
@@ -332,7 +704,7 @@ class Simulator:
         # labels = []
 
         # check if the first waveform in the current waveform set is a number or another waveform
-        while type(self.sch.ws.dr.get_elem(y_vecs[0], 0)) != float:
+        while not isinstance(self.sch.ws.dr.get_elem(y_vecs[0], 0), (int, float, complex)):
             next_x_vecs = []
             next_y_vecs = []
 
@@ -357,8 +729,42 @@ class Simulator:
         return y_vecs, x_vecs
 
 
+    # fetches every leaf of a parametric family in a single call
+    # returns the family values of each leaf (n_sweep, n_levels), the y arrays and the x arrays (None unless with_x)
+    # the family levels are not always the swept parameters, sweep_coords is built from param_sets instead
+    def family_to_arrays(self, waveform, with_x=False):
+        define_skill(self.sch.ws, 'vpFamilyLeaves')
+        leaves = self.sch.ws['vpFamilyLeaves'](waveform, with_x)
+
+        coords = np.asarray([leaf[0] if leaf[0] is not None else [] for leaf in leaves])
+        ys = [np.asarray(leaf[1]) for leaf in leaves]
+        xs = None
+        if with_x:
+            xs = [np.asarray(leaf[2]) for leaf in leaves]
+
+        return coords, ys, xs
+
     # used in extract waves during parametric analysis
+    # each wave becomes a (n_sweep, n_time) array, or a RaggedArray if the sweep points have different time grids
     def param_waveform_to_vector(self, waveforms):
+        if not self.bulk_transfer:
+            return self.unpacked_param_waveform_to_vector(waveforms)
+
+        waves_y_data = []
+        x_data = None
+
+        for i, wave in enumerate(waveforms):
+            # x vector is same for all y vectors
+            _, ys, xs = self.family_to_arrays(wave, with_x=(i == 0))
+            if i == 0:
+                x_data = stack_sweep(xs)
+
+            waves_y_data.append(stack_sweep(ys))
+
+        return waves_y_data, x_data
+
+    # per element version of param_waveform_to_vector, used when bulk_transfer is off
+    def unpacked_param_waveform_to_vector(self, waveforms):
         waves_y_data = []
         x_data = []
 
@@ -368,11 +774,7 @@ class Simulator:
 
             y_data = []
             for y_vec in y_vecs:
-                y_data.append([])
-                for i in range(self.sch.ws.dr.vector_length(y_vec)):
-                    y_data[-1].append(self.sch.ws.dr.get_elem(y_vec, i)) #type:ignore
-
-                y_data[-1] = np.asarray(y_data[-1])
+                y_data.append(self.vector_to_array(y_vec))
 
             waves_y_data.append(y_data)
 
@@ -380,11 +782,7 @@ class Simulator:
         _, x_vecs = self.unpack_nested_waveform(waveforms[0])
 
         for x_vec in x_vecs:
-            x_data.append([])
-            for i in range(self.sch.ws.dr.vector_length(x_vec)):
-                x_data[-1].append(self.sch.ws.dr.get_elem(x_vec, i)) #type:ignore
-
-            x_data[-1] = np.asarray(x_data[-1])
+            x_data.append(self.vector_to_array(x_vec))
         
         return waves_y_data, x_data
 
@@ -400,6 +798,57 @@ class Simulator:
     # ))
     # paramRun()
 
+    # hashes the file timestamps of every cellview (and CDF) in the design hierarchy
+    def design_signature(self):
+        define_skill(self.sch.ws, 'vpHierarchyStamps')
+        stamps = self.sch.ws['vpHierarchyStamps'](self.sch.lib_name, self.sch.cell_name, self.view)
+        settings = [self.sch.lib_name, self.sch.cell_name, self.view, sorted(stamps or [])]
+        return hashlib.sha256(json.dumps(settings, default=str).encode()).hexdigest()
+
+    def netlist(self, show_netlist=False, force=False):
+        """
+        Netlist the design unless the netlist in results_dir is still current
+
+        Parameters
+        ----------
+        show_netlist : bool
+            open the netlist in Virtuoso
+        force : bool
+            renetlist the whole hierarchy even if nothing changed
+
+        Returns
+        -------
+        True if the netlist is current, False if netlisting failed
+        """
+        sig_file = os.path.join(self.results_dir, 'netlist', '.vp_netlist_sig')
+        sig = None
+        recreate_all = force or self.renetlist == 'always'
+
+        if not recreate_all:
+            sig = self.design_signature()
+            if os.path.isfile(os.path.join(self.results_dir, 'netlist', 'netlist')) and os.path.isfile(sig_file):
+                with open(sig_file, 'r') as f:
+                    if f.read() == sig:
+                        if self.verbose:
+                            print('Netlist is up to date')
+                        return True
+
+        # without recreate_all only the cells which changed since the last netlist are renetlisted
+        if self.sch.ws['createNetlist'](recreate_all=recreate_all, display=show_netlist) == None:
+            if self.verbose:
+                print('ERROR netlist not created')
+            return False
+
+        # the design signature is only needed to reuse the netlist later
+        if self.renetlist == 'always':
+            return True
+        if sig is None:
+            sig = self.design_signature()
+        os.makedirs(os.path.dirname(sig_file), exist_ok=True)
+        with open(sig_file, 'w') as f:
+            f.write(sig)
+        return True
+
     def call_paramAnalysis(self, p_values):
         l, v = list(p_values.items())[0]
         if len(p_values) == 1:
@@ -409,8 +858,390 @@ class Simulator:
             return self.sch.ws['paramAnalysis'](l, self.call_paramAnalysis(p_values), values=v, sweep_type=Symbol('paramset'))
 
     
+    # keeps the results of each run in ./sim_output/.cache, keyed on a hash of the netlist, stimuli, model files,
+    # analysis settings and sweep values. A run with identical inputs restores its results instead of simulating.
+    def enable_cache(self, max_entries=50, max_bytes=None, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = os.getcwd() + '/sim_output/.cache'
+        self.cache = ResultCache(cache_dir, max_entries, max_bytes)
+
+    # keeps the waves of each run in a memory-mapped file under <results_dir>/waves instead of in memory
+    # waves[name]['y'] and x become read-only views into the file, a time axis shared by all sweep points is stored once
+    def enable_wave_store(self, store_dir=None, keep=2):
+        if store_dir is None:
+            store_dir = os.path.join(self.results_dir, 'waves')
+        self.wave_store = WaveStore(store_dir, keep)
+
+    # moves the waves of the last run into the wave store
+    def store_waves(self):
+        names = [name for name in self.waves if 'fn' not in self.waves[name] and 'y' in self.waves[name]]
+        _, x, views = self.wave_store.write(self.x, {name: self.waves[name]['y'] for name in names})
+        self.x = x
+        for name in names:
+            self.waves[name]['y'] = views[name]
+
+    def window(self, t0, t1, names=None):
+        """
+        Return the waves between times t0 and t1, as views so only that part of a stored run is read
+
+        Parameters
+        ----------
+        t0, t1 : float
+            start and end of the window in seconds
+        names : list of strings
+            waves to return, defaults to every wave (custom waves are calculated in full and then sliced)
+
+        Returns
+        -------
+        dictionary with 'x' and each wave name. For a sweep on a shared time grid these are (n_sweep, n_window)
+        arrays, otherwise lists with one array per sweep point
+        """
+        if names is None:
+            names = list(self.waves.keys())
+
+        x = self.x
+        out = {}
+        if isinstance(x, np.ndarray) and x.ndim == 1:
+            i0, i1 = window_indices(x, t0, t1)
+            out['x'] = x[i0:i1]
+            for name in names:
+                out[name] = self.waves[name]['y'][i0:i1]
+            return out
+
+        if isinstance(x, np.ndarray) and x.ndim == 2 and x.strides[0] == 0:
+            # shared time grid (broadcast), one search for every sweep point
+            i0, i1 = window_indices(x[0], t0, t1)
+            out['x'] = x[:, i0:i1]
+            for name in names:
+                out[name] = np.asarray(self.waves[name]['y'])[:, i0:i1]
+            return out
+
+        bounds = [window_indices(row, t0, t1) for row in x]
+        out['x'] = [row[i0:i1] for row, (i0, i1) in zip(x, bounds)]
+        for name in names:
+            y = self.waves[name]['y']
+            out[name] = [y[i][i0:i1] for i, (i0, i1) in enumerate(bounds)]
+        return out
+
+    # removes the cached results of the last run, or every cached result if everything is True
+    def invalidate_cache(self, everything=False):
+        if self.cache is None:
+            return
+        if everything:
+            self.cache.invalidate()
+        elif self.cache_key_last is not None:
+            self.cache.invalidate(self.cache_key_last)
+
+    # hashes all of the inputs of a run, returns None if the netlist can not be found
+    def cache_key(self, p_values):
+        netlist_dir = os.path.join(self.results_dir, 'netlist')
+        files = []
+        for f in ['netlist', 'netlistHeader', 'netlistFooter', 'input.scs']:
+            if os.path.isfile(os.path.join(netlist_dir, f)):
+                files.append(os.path.join(netlist_dir, f))
+
+        if len(files) == 0:
+            return None
+
+        if self.stim_filename is not None:
+            files.append(self.stim_filename)
+        files += self.model_files
+
+        settings = {}
+        settings['design'] = [self.sch.lib_name, self.sch.cell_name]
+        settings['temp'] = self.temp
+        settings['duration'] = getattr(self, 'duration', None)
+        settings['errpreset'] = getattr(self, 'errpreset', None)
+        settings['design_vars'] = self.design_vars
+        settings['p_values'] = p_values
+        settings['waves'] = sorted(name for name in self.waves if 'fn' not in self.waves[name])
+
+        return self.cache.key(files, settings)
+
+    # restores the results of a cached run, returns False on a cache miss
+    def restore_cached(self, key, p_values):
+        cached = self.cache.load(key)
+        if cached is None:
+            return False
+
+        x, waves, sweep_coords = cached
+        names = [name for name in self.waves if 'fn' not in self.waves[name]]
+        if any(name not in waves for name in names):
+            return False
+
+        if p_values != None:
+            self.param_sets = p_values
+
+        self.x = x
+        self.sweep_coords = sweep_coords
+        for name in names:
+            self.waves[name]['y'] = waves[name]['y']
+            self.waves[name]['signal_type'] = waves[name]['signal_type']
+
+        self.run_ok = True
+        if self.wave_store is not None:
+            self.store_waves()
+        self.invalidate_custom()
+        if self.verbose:
+            print('Restored results from cache')
+        return True
+
+    # p_values may be a Sweep (eg. Product(w=[1e-6, 2e-6], l=[1e-7, 2e-7])), which is run as the equivalent paramset
+    def expand_sweep(self, p_values):
+        if isinstance(p_values, Sweep):
+            self.sweep = p_values
+            return p_values.p_values()
+
+        self.sweep = None
+        if p_values != None:
+            lengths = [len(v) for v in p_values.values()]
+            if len(set(lengths)) > 1:
+                raise Exception(f'All parameter lists of a paramset must be the same length, found {lengths}. Use Product(...) for a full factorial sweep')
+        return p_values
+
+    def labelled(self, name):
+        """
+        Return the results of a wave after a sweep as a LabelledArray, indexed by parameter value
+        (eg. sim.labelled('/out').sel(w=2e-6))
+
+        Product sweeps are reshaped onto their grid, other sweeps have one 'point' axis
+        """
+        if self.param_sets == None:
+            raise Exception('labelled() needs the results of a sweep, run with p_values first')
+
+        sweep = self.sweep
+        if sweep is None:
+            # a plain paramset
+            sweep = Sweep(self.param_sets.keys(), paramset_coords(self.param_sets))
+        return labelled(sweep, self.x if name == 'x' else self.waves[name]['y'])
+
+    def adaptive_sweep(self, param, start, stop, metric, tol, n_initial=5, budget=50, min_step=None, fixed=None):
+        """
+        Sweep one parameter, only adding points where the metric changes by more than tol
+
+        Starts with n_initial evenly spaced points, then repeatedly bisects every interval whose metric changes by more
+        than tol (largest changes first) until no interval does, it is narrower than min_step or budget simulations
+        have been run. The new points of each round are simulated together as one paramset.
+
+        Parameters
+        ----------
+        param : string
+            design variable to sweep (eg. 'vin')
+        start, stop : float
+            range of the sweep
+        metric : function
+            called with this Simulator after each run, returns one number per sweep point of that run
+            (eg. lambda s: s.waves['/out']['y'][:, -1])
+        tol : float
+            largest change of the metric allowed between neighbouring points
+        n_initial : int
+            number of points in the first, coarse run
+        budget : int
+            maximum number of simulated points
+        min_step : float
+            intervals narrower than this are not split, defaults to (stop - start) / 1e6
+        fixed : dictionary
+            other design variables, held at one value for the whole sweep
+
+        Returns
+        -------
+        values, metrics : np arrays of the simulated parameter values (sorted) and their metric.
+        The waves of every point are kept in self.waves in the same order, with param_sets set to match. Waves which
+        were missing from the results of any round are removed, as load_results does.
+        """
+        if min_step is None:
+            min_step = abs(stop - start) / 1e6
+        fixed = fixed if fixed is not None else {}
+
+        values = []
+        metrics = []
+        x_rows = []
+        rows = {}
+        # everything but 'y' of each wave, a failed round can leave self.waves half loaded
+        meta = {}
+
+        def simulate(points):
+            p_values = {param: list(points)}
+            for p, v in fixed.items():
+                p_values[p] = [v] * len(points)
+            if self.run(p_values=p_values) == None:
+                return False
+
+            m = np.asarray(metric(self), dtype=np.float64).ravel()
+            values.extend(points)
+            metrics.extend(m)
+            x_rows.extend(list(self.x))
+            for name in self.waves:
+                if 'fn' not in self.waves[name]:
+                    rows.setdefault(name, []).extend(list(self.waves[name]['y']))
+                    meta[name] = {k: v for k, v in self.waves[name].items() if k != 'y'}
+            return True
+
+        ok = simulate(list(np.linspace(start, stop, min(n_initial, budget))))
+        while ok and len(values) < budget:
+            order = np.argsort(values)
+            v = np.asarray(values)[order]
+            m = np.asarray(metrics)[order]
+
+            change = np.abs(np.diff(m))
+            split = (change > tol) & (np.diff(v) > 2 * min_step)
+            candidates = np.flatnonzero(split)
+            if len(candidates) == 0:
+                break
+
+            candidates = candidates[np.argsort(-change[candidates])][:budget - len(values)]
+            ok = simulate(list((v[candidates] + v[candidates + 1]) / 2))
+
+        if len(values) == 0:
+            return np.asarray(values), np.asarray(metrics)
+
+        # keep the waves of every point, sorted by parameter value
+        order = np.argsort(values)
+        self.sweep = None
+        self.param_sets = {param: [float(values[i]) for i in order]}
+        for p, v in fixed.items():
+            self.param_sets[p] = [v] * len(order)
+        self.x = stack_sweep([x_rows[i] for i in order])
+        self.sweep_coords = paramset_coords(self.param_sets)
+        for name in [n for n in self.waves if 'fn' not in self.waves[n] and n not in meta]:
+            self.waves.pop(name)
+        for name, r in rows.items():
+            if len(r) == len(order):
+                self.waves[name] = dict(meta[name], y=stack_sweep([r[i] for i in order]))
+            else:
+                self.waves.pop(name, None)
+        self.invalidate_custom()
+
+        if self.verbose:
+            print(f'Adaptive sweep of {param} used {len(values)} of {budget} simulations')
+        return np.asarray(values)[order], np.asarray(metrics)[order]
+
     # runs the simulation
+    # p_values is a paramset (dictionary of equal length lists, zipped together) or a Sweep
     def run(self, plot_in_v=False, p_values=None):
+        p_values = self.expand_sweep(p_values)
+        return self.locked(self.run_locked, plot_in_v, p_values)
+
+    # runs the simulation without blocking the event loop, so simulators on different workspaces can run concurrently
+    #   await asyncio.gather(sim_a.run_async(), sim_b.run_async(p_values=p))
+    # each phase (cache lookup, simulation, extraction) is awaited on Simulator.async_executor, so one simulator
+    # extracts its waves while simulators on other workspaces are still simulating. The workspace lock is held from the
+    # first phase to the last, runs on the same workspace are serialized.
+    # the waves of a run can not be extracted while it is still simulating, OCEAN's run() only returns once every
+    # sweep point is done
+    async def run_async(self, plot_in_v=False, p_values=None):
+        p_values = self.expand_sweep(p_values)
+        executor = Simulator.get_async_executor()
+        lock = self.workspace_lock()
+
+        # the lock is taken in a worker thread so waiting for another run does not block the event loop
+        acquired = executor.submit(lock.acquire)
+        current = acquired
+        try:
+            await asyncio.wrap_future(current)
+            if _workspace_owners.get(id(self.sch.ws)) != id(self):
+                current = executor.submit(self.setup_session)
+                await asyncio.wrap_future(current)
+
+            current = executor.submit(self.prepare_run, p_values)
+            key, hit = await asyncio.wrap_future(current)
+            if hit:
+                return 0
+
+            current = executor.submit(self.simulate, plot_in_v, p_values)
+            await asyncio.wrap_future(current)
+            current = executor.submit(self.finish_run, key)
+            return await asyncio.wrap_future(current)
+        finally:
+            # a cancelled phase keeps running in its thread, the lock is released once it is done
+            current.add_done_callback(lambda _: None if acquired.cancelled() else lock.release())
+
+    # a whole run, called with the workspace lock held so no other simulator of the workspace can change the OCEAN
+    # session (design, results directory, selected results ...) between simulating and extracting the waves
+    def run_locked(self, plot_in_v=False, p_values=None):
+        if _workspace_owners.get(id(self.sch.ws)) != id(self):
+            self.setup_session()
+
+        key, hit = self.prepare_run(p_values)
+        if hit:
+            return 0
+
+        self.simulate(plot_in_v, p_values)
+        return self.finish_run(key)
+
+    # shared, bounded thread pool for run_async
+    async_executor = None
+    async_workers = 8
+
+    @classmethod
+    def get_async_executor(cls):
+        if cls.async_executor is None:
+            cls.async_executor = ThreadPoolExecutor(max_workers=cls.async_workers)
+        return cls.async_executor
+
+    # the lock of this simulator's workspace
+    def workspace_lock(self):
+        with _workspace_locks_lock:
+            return _workspace_locks.setdefault(id(self.sch.ws), threading.Lock())
+
+    # calls fn while holding the lock of this simulator's workspace
+    def locked(self, fn, *args):
+        with self.workspace_lock():
+            return fn(*args)
+
+    # starts a run, returns the cache key and whether the results were restored from the cache
+    def prepare_run(self, p_values):
+        self.run_start = time.time()
+
+        key = None
+        if self.cache is not None:
+            key = self.cache_key(p_values if p_values != None else self.param_sets)
+            self.cache_key_last = key
+            if key is not None and self.restore_cached(key, p_values):
+                return key, True
+
+        return key, False
+
+    def use_spectre(self, spectre_cmd='spectre', max_workers=None, extra_args=None, run_dir=None, licenses=None, retries=1,
+                    fail_fast=False):
+        """
+        Run simulations by starting spectre directly on the netlist instead of through OCEAN
+
+        Only netlisting needs Virtuoso, each run writes a standalone input deck per sweep point and runs the points
+        on a process pool, each in its own directory. Results are read from the PSF files.
+
+        Parameters
+        ----------
+        spectre_cmd : string
+            command used to start spectre, may include arguments (eg. 'spectre +aps')
+        max_workers : int
+            number of spectre processes running at once, defaults to the number of CPUs
+        extra_args : list of strings
+            appended to every spectre command line
+        run_dir : string
+            where the decks and results are written, defaults to <results_dir>/spectre. Its point<i> subdirectories
+            are replaced on every run
+        licenses : int
+            number of spectre licenses available, also limits the processes running at once
+        retries : int
+            how often a failed point is run again
+        fail_fast : bool
+            cancel the remaining points of a sweep as soon as one point has failed all of its retries
+        """
+        if run_dir is None:
+            run_dir = os.path.join(self.results_dir, 'spectre')
+        self.spectre = SpectreBackend(os.path.join(self.results_dir, 'netlist'), run_dir, spectre_cmd, max_workers,
+                                      extra_args, self.verbose, licenses, retries, fail_fast)
+        return self.spectre
+
+    # sets up the analysis in OCEAN and runs spectre
+    def simulate(self, plot_in_v=False, p_values=None):
+        if self.spectre is not None:
+            if p_values != None:
+                self.param_sets = p_values
+            self.spectre.run(self.saves, self.duration, self.errpreset, self.temp, self.model_files,
+                             self.stim_filename, params=self.design_vars, p_values=p_values)
+            return
 
         if p_values != None:
             # store the parameter sets
@@ -425,6 +1256,11 @@ class Simulator:
             # call the recusive paramAnalysis function
             self.call_paramAnalysis(p_values.copy())
             self.sch.ws['paramRun']()
+
+            # swept design variables go back to their set_var value for later runs
+            for param in self.param_sets:
+                if param in self.design_vars:
+                    self.sch.ws['desVar'](param, self.design_vars[param])
         else:
             # set temp and run
             self.sch.ws['temp'](self.temp)
@@ -444,16 +1280,25 @@ class Simulator:
                     continue
                 self.sch.ws['plot'](self.sch.ws.get.data(name))
 
+    # extracts and checks the waves of a finished simulation, returns 0 on success and None on failure
+    def finish_run(self, key=None):
         self.extract_waves()
 
 
         if self.run_ok == False:
-            print('Simulation Failed. see ' + f'"./sim_output/{self.sch.cell_name}/psf/spectre.out" for details.' )
-            print('From spectre.out :\n')
-            with open(f'./sim_output/{self.sch.cell_name}/psf/spectre.out', 'r') as f:
-                for l in f:
-                    if 'error' in l.lower() or 'warning' in l.lower():
-                        print('\t' + l)
+            logs = [f'{self.results_dir}/psf/spectre.out']
+            if self.spectre is not None:
+                logs = self.spectre.log_files()
+
+            for log in logs:
+                print('Simulation Failed. see ' + f'"{log}" for details.' )
+                if not os.path.isfile(log):
+                    continue
+                print('From spectre.out :\n')
+                with open(log, 'r') as f:
+                    for l in f:
+                        if 'error' in l.lower() or 'warning' in l.lower():
+                            print('\t' + l)
         
             return None
 
@@ -467,7 +1312,14 @@ class Simulator:
                 if self.check_sim_dur(x[-1]) == 1:
                     return None
 
-        self.calc_custom()
+        if key is not None:
+            names = [name for name in self.waves if 'fn' not in self.waves[name]]
+            self.cache.store(key, self.x, {name: self.waves[name] for name in names}, self.sweep_coords)
+
+        if self.wave_store is not None:
+            self.store_waves()
+
+        self.invalidate_custom()
         return 0
 
     def check_sim_dur(self, sim_dur):
@@ -478,6 +1330,34 @@ class Simulator:
             return 1
         return 0
 
+    # rows of x and y of a wave, one per sweep point
+    def wave_rows(self, name):
+        if self.param_sets == None:
+            return [self.x], [self.waves[name]['y']]
+        return self.x, self.waves[name]['y']
+
+    # min/max envelope of sweep point i of a wave, built on first use
+    def pyramid(self, name, i):
+        if (name, i) not in self.pyramids:
+            xs, ys = self.wave_rows(name)
+            self.pyramids[(name, i)] = MinMaxPyramid(xs[i], ys[i])
+        return self.pyramids[(name, i)]
+
+    # minimum and maximum of a wave over every sweep point, cached until the next run
+    def wave_range(self, name):
+        if name not in self.wave_ranges:
+            ranges = [self.pyramid(name, i).range() for i in range(len(self.wave_rows(name)[1]))]
+            self.wave_ranges[name] = (min(r[0] for r in ranges), max(r[1] for r in ranges))
+        return self.wave_ranges[name]
+
+    # redraws the decimated lines of ax for its new x limits
+    def refine(self, ax):
+        t0, t1 = ax.get_xlim()
+        for ax_i, line, pyr in self.decimated:
+            if ax_i is ax:
+                px, py = pyr.points(t0 / 1e9, t1 / 1e9, self.plot_max_points)
+                line.set_data(px * 1e9, py)
+
     # for the checkboxes in the interactive plot
     def toggle(self, state):
         if isinstance(state['new'], bool):
@@ -515,8 +1395,9 @@ class Simulator:
                     if self.waves[name]['type'] == ax_type:
                         for pl in self.waves[name]['pl']:
                             if pl.get_visible():
-                                mins.append(np.min(self.waves[name]['y']))
-                                maxes.append(np.max(self.waves[name]['y']))
+                                w_min, w_max = self.wave_range(name)
+                                mins.append(w_min)
+                                maxes.append(w_max)
 
                 
                 if len(mins) > 0:
@@ -544,6 +1425,7 @@ class Simulator:
         if interactive:
             plt.ion()
 
+        self.decimated = []
         self.fig, _ = plt.subplots(len(self.cust_data_types) + len(self.groups), figsize=(8, 3*len(self.cust_data_types)), sharex=True)
 
         ax = self.fig.axes
@@ -580,7 +1462,14 @@ class Simulator:
                 plot_y = [plot_y]
             pls = []
             for (i,x), y in zip(enumerate(plot_x), plot_y):
-                pls.append(cur_ax.plot(x * 1e9, y, label=name, linestyle=linestyles[i], color=colors[self.ax_info[y_label]['count']-1])[0])
+                # long waves are drawn from their min/max envelope, see refine()
+                pyr = None
+                if len(x) > self.plot_max_points:
+                    pyr = self.pyramid(name, i)
+                    x, y = pyr.points(x[0], x[-1], self.plot_max_points)
+                pls.append(cur_ax.plot(x * 1e9, y, label=name, linestyle=linestyles[i % len(linestyles)], color=colors[self.ax_info[y_label]['count']-1])[0])
+                if pyr is not None:
+                    self.decimated.append((cur_ax, pls[-1], pyr))
                 if i == 0:
                     legend_elements[y_label].append(Line2D([0], [0], color=colors[self.ax_info[y_label]['count']-1], label=name))
 
@@ -592,7 +1481,9 @@ class Simulator:
             ncol = max((1,int(self.ax_info[l]['count']/ 5)))
             # ax_i.legend(tuple(lines[l]), tuple(labels[l]), loc=(1.01,0.0), shadow=True)
             if self.param_sets != None:
-                for i in range(len(list(self.param_sets.values())[0])):
+                # line styles repeat after the first few sweep points, only those are listed in the legend
+                n_points = len(list(self.param_sets.values())[0])
+                for i in range(min(n_points, len(linestyles))):
                     v = []
                     p = '['
                     for v_i in list(self.param_sets.values()):
@@ -603,12 +1494,18 @@ class Simulator:
                         
                     p = p[:-2] + ']'
                     legend_elements[l].append(Line2D([0], [0], color='k', linestyle=linestyles[i], label=f'{p} = {v}'))
+                if n_points > len(linestyles):
+                    legend_elements[l].append(Line2D([0], [0], color='k', linestyle='none', label=f'... {n_points} points'))
             
             ax_i.legend(handles=legend_elements[l], loc=(1.01,0.0), shadow=True)
             # ax_i.legend(loc=(1.01,0.0), ncol = ncol)
     
         ax[-1].set_xlabel('Time (ns)')
 
+        if len(self.decimated) > 0:
+            for ax_i in ax:
+                ax_i.callbacks.connect('xlim_changed', self.refine)
+
         if interactive:
             # widgets (check boxes)
             ch_bxs = []
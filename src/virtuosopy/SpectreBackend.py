@@ -0,0 +1,255 @@
+# Runs spectre directly on the netlist written by createNetlist, without OCEAN or a Virtuoso license.
+# Each sweep point gets its own input deck and raw directory under run_dir and the points run on a process pool,
+# bounded by the number of CPUs and spectre licenses. Failed points are retried, the rest of the sweep can be
+# cancelled. Results are written as PSF-ASCII so they can be read with PSFReader.
+#
+# input deck written for each point:
+#   simulator lang=spectre
+#   global 0
+#   include "<model file>"
+#   include "<netlist_dir>/netlist"
+#   include "<stimuli file>"
+#   parameters w=1u l=100n
+#   vpOptions options temp=27
+#   tran tran stop=1e-08 errpreset=moderate
+#   save out I0:D
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import subprocess
+import signal
+import shlex
+import time
+import shutil
+import glob
+import os
+
+from .PSFReader import load_psf_waves
+
+
+# runs one sweep point in a worker process, retrying up to retries times
+# the pid of the running spectre is kept in <point_dir>/spectre.pid so SpectreBackend.cancel() can stop it
+# returns (None, attempt) if the point was cancelled, also when its spectre was stopped by the cancel
+def _run_point(cmd, point_dir, retries):
+    pid_file = os.path.join(point_dir, 'spectre.pid')
+    cancelled = os.path.join(point_dir, 'cancelled')
+    rc = None
+    for attempt in range(retries + 1):
+        if os.path.exists(cancelled):
+            return None, attempt
+
+        with open(os.path.join(point_dir, 'spectre.stdout'), 'w') as out:
+            p = subprocess.Popen(cmd, stdout=out, stderr=subprocess.STDOUT, cwd=point_dir)
+            with open(pid_file, 'w') as f:
+                f.write(str(p.pid))
+            # cancel() may have looked for the pid file before it was written
+            if os.path.exists(cancelled):
+                p.terminate()
+            rc = p.wait()
+            os.remove(pid_file)
+
+        if rc != 0 and os.path.exists(cancelled):
+            return None, attempt
+
+        if rc == 0:
+            break
+    return rc, attempt
+
+
+class SpectreBackend:
+    def __init__(self, netlist_dir, run_dir, spectre_cmd='spectre', max_workers=None, extra_args=None, verbose=True,
+                 licenses=None, retries=1, fail_fast=False):
+        """
+        Parameters
+        ----------
+        netlist_dir : string
+            directory holding the netlist from createNetlist (eg. ./sim_output/<cell>/netlist)
+        run_dir : string
+            directory for the input decks and results, one point<i> subdirectory per sweep point
+        spectre_cmd : string
+            command used to start spectre, may include arguments (eg. 'spectre +aps')
+        max_workers : int
+            number of spectre processes running at once, defaults to the number of CPUs
+        extra_args : list of strings
+            appended to every spectre command line
+        licenses : int
+            number of spectre licenses available, also limits the processes running at once
+        retries : int
+            how often a failed point is run again before it counts as failed
+        fail_fast : bool
+            cancel the remaining points of a run as soon as one point has failed all of its retries
+        """
+        self.netlist_dir = os.path.abspath(netlist_dir)
+        self.run_dir = os.path.abspath(run_dir)
+        self.spectre_cmd = spectre_cmd
+        self.max_workers = max_workers
+        self.extra_args = extra_args if extra_args is not None else []
+        self.verbose = verbose
+        self.licenses = licenses
+        self.retries = retries
+        self.fail_fast = fail_fast
+        # return code of each point of the last run, None for points which were cancelled
+        self.returncodes = []
+        # time the last run started, older result files under run_dir are not loaded
+        self.run_start = None
+        self.futures = []
+
+    @property
+    def ok(self):
+        return len(self.returncodes) > 0 and all(rc == 0 for rc in self.returncodes)
+
+    # processes used for a sweep of n_points
+    def workers(self, n_points):
+        limits = [n_points, self.max_workers or os.cpu_count() or 1]
+        if self.licenses is not None:
+            limits.append(self.licenses)
+        return max(1, min(limits))
+
+    def point_dir(self, i):
+        return os.path.join(self.run_dir, f'point{i}')
+
+    def write_deck(self, filename, saves, duration, errpreset=None, temp=27, model_files=None, stim_file=None, params=None):
+        """
+        Write a standalone spectre input deck
+
+        Parameters
+        ----------
+        saves : dictionary
+            Simulator wave name -> 'v' or 'i' (eg. {'/out': 'v', '/I0/D': 'i'})
+        duration : float
+            stop time of the transient analysis
+        params : dictionary
+            parameter name -> value for this point
+        """
+        lines = ['// written by virtuosopy', 'simulator lang=spectre', 'global 0']
+
+        for m in model_files or []:
+            lines.append(f'include "{m}"')
+
+        header = os.path.join(self.netlist_dir, 'netlistHeader')
+        if os.path.isfile(header):
+            lines.append(f'include "{header}"')
+        lines.append(f'include "{os.path.join(self.netlist_dir, "netlist")}"')
+
+        footer = os.path.join(self.netlist_dir, 'netlistFooter')
+        if os.path.isfile(footer):
+            lines.append(f'include "{footer}"')
+
+        if stim_file is not None:
+            lines.append(f'include "{stim_file}"')
+
+        if params:
+            lines.append('parameters ' + ' '.join(f'{p}={v}' for p, v in params.items()))
+
+        lines.append(f'vpOptions options temp={temp}')
+        lines.append(f'tran tran stop={duration} errpreset={errpreset if errpreset is not None else "moderate"}')
+
+        names = [spectre_save_name(name, kind) for name, kind in saves.items()]
+        if len(names) > 0:
+            lines.append('save ' + ' '.join(names))
+
+        with open(filename, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def command(self, deck, point_dir):
+        return shlex.split(self.spectre_cmd) + ['-format', 'psfascii', '-raw', os.path.join(point_dir, 'psf'),
+                                                '=log', os.path.join(point_dir, 'spectre.out'), deck] + self.extra_args
+
+    def run(self, saves, duration, errpreset=None, temp=27, model_files=None, stim_file=None, params=None, p_values=None,
+            fail_fast=None):
+        """
+        Run one simulation, or one per sweep point of p_values, and wait for all of them
+
+        Parameters
+        ----------
+        p_values : dictionary
+            parameter name -> list of values, all lists the same length (as in Simulator.run)
+        fail_fast : bool
+            cancel the remaining points as soon as one point has failed all of its retries, None for self.fail_fast
+
+        Returns
+        -------
+        True if every point finished successfully
+        """
+        if fail_fast is None:
+            fail_fast = self.fail_fast
+        self.run_start = time.time()
+        if not os.path.isfile(os.path.join(self.netlist_dir, 'netlist')):
+            raise Exception(f"No netlist found in '{self.netlist_dir}'. Run createNetlist first (see Simulator.netlist)")
+
+        points = [dict(params or {})]
+        if p_values is not None:
+            n_points = len(list(p_values.values())[0])
+            points = [dict(params or {}, **{p: v[i] for p, v in p_values.items()}) for i in range(n_points)]
+
+        # results of an earlier, larger sweep would otherwise be picked up by the reader
+        # only the point directories are removed, run_dir itself may hold other files of the caller
+        for point_dir in glob.glob(os.path.join(self.run_dir, 'point*')):
+            if os.path.isdir(point_dir):
+                shutil.rmtree(point_dir)
+
+        commands = []
+        for i, point in enumerate(points):
+            point_dir = self.point_dir(i)
+            os.makedirs(point_dir, exist_ok=True)
+            deck = os.path.join(point_dir, 'input.scs')
+            self.write_deck(deck, saves, duration, errpreset, temp, model_files, stim_file, point)
+            commands.append(self.command(deck, point_dir))
+
+        self.returncodes = [None] * len(points)
+        with ProcessPoolExecutor(max_workers=self.workers(len(points))) as ex:
+            self.futures = [ex.submit(_run_point, cmd, self.point_dir(i), self.retries) for i, cmd in enumerate(commands)]
+            index = {fut: i for i, fut in enumerate(self.futures)}
+
+            for fut in as_completed(self.futures):
+                i = index[fut]
+                if fut.cancelled():
+                    continue
+                rc, attempt = fut.result()
+                self.returncodes[i] = rc
+                if rc is None:
+                    continue
+
+                if rc != 0:
+                    if self.verbose:
+                        print(f'spectre failed on point {i} (exit code {rc}, {attempt + 1} attempts). See "{self.point_dir(i)}/spectre.out"')
+                    if fail_fast:
+                        self.cancel()
+                elif attempt > 0 and self.verbose:
+                    print(f'point {i} succeeded after {attempt + 1} attempts')
+
+        self.futures = []
+        return self.ok
+
+    def cancel(self):
+        """
+        Cancel the points of the running sweep which have not finished, eg. from another thread
+        Points which have not started are dropped and running spectre processes are terminated
+        """
+        for fut in self.futures:
+            fut.cancel()
+
+        for point_dir in glob.glob(os.path.join(self.run_dir, 'point*')):
+            # stops further retries of this point
+            open(os.path.join(point_dir, 'cancelled'), 'w').close()
+            pid_file = os.path.join(point_dir, 'spectre.pid')
+            try:
+                with open(pid_file, 'r') as f:
+                    os.kill(int(f.read()), signal.SIGTERM)
+            except (OSError, ValueError):
+                pass
+
+    # spectre.out of every point of the last run
+    def log_files(self):
+        return sorted(glob.glob(os.path.join(self.run_dir, 'point*', 'spectre.out')))
+
+    def load(self, names):
+        # same as PSFReader.load_psf_waves on the results of the last run, in sweep order
+        return load_psf_waves(self.run_dir, names, newer_than=self.run_start)
+
+
+# '/out' -> 'out', '/I0/net1' -> 'I0.net1' for voltages, '/I0/M0/D' -> 'I0.M0:D' for terminal currents
+def spectre_save_name(name, kind='v'):
+    parts = name.strip('/').split('/')
+    if kind == 'i' and len(parts) > 1:
+        return '.'.join(parts[:-1]) + ':' + parts[-1]
+    return '.'.join(parts)
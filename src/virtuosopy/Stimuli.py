@@ -0,0 +1,204 @@
+# Compiles the stimuli dictionary of Simulator.apply_stims into spectre source lines.
+#
+# pwl waves can be given as a string ('0 0 1n 1.2 ...', eg. from create_wave), as (time, value) arrays
+# (eg. from create_wave_arrays) or as an (n, 2) array. Waves with more than file_threshold breakpoints are written to
+# a separate data file which the source reads with file=, identical waves share one data file.
+#   _vIn (In 0) vsource type=pwl file="<data_dir>/pwl_<hash>.pwl"
+#
+# Several stimulus patterns can be compiled into one file which selects a pattern with a design variable (see
+# compile_patterns). Each pattern drives its own internal node and the net is driven through one controlled source per
+# pattern with gain 1 for the selected pattern and 0 for the others:
+#   _vIn_p0 (vp_In_0 0) vsource dc=0 type=dc
+#   _vIn_p1 (vp_In_1 0) vsource dc=1.2 type=dc
+#   _eIn_p0 (vp_In_s0 0) vcvs (vp_In_0 0) gain=1-min(abs(vp_pattern-0),1)
+#   _eIn_p1 (In vp_In_s0) vcvs (vp_In_1 0) gain=1-min(abs(vp_pattern-1),1)
+# Currents are summed with vccs in parallel instead, each pattern's isource drives a 1 ohm resistor.
+
+import numpy as np
+import hashlib
+import io
+import os
+import re
+
+from .vp_utils import iter_pwl
+
+
+stim_functions = ['bit', 'pwl', 'dc']
+
+
+class StimulusCompiler:
+    def __init__(self, data_dir, bit_defaults=None, file_threshold=2000, chunk_size=100000, verbose=True):
+        """
+        Parameters
+        ----------
+        data_dir : string
+            directory for the pwl data files
+        bit_defaults : dictionary
+            values used for missing keys of 'bit' stimuli (see Simulator.bit_stim_defaults)
+        file_threshold : int
+            pwl waves with more breakpoints than this are written to a data file, None to always write them inline
+        chunk_size : int
+            number of breakpoints formatted at a time
+        """
+        self.data_dir = data_dir
+        self.bit_defaults = bit_defaults if bit_defaults is not None else {}
+        self.file_threshold = file_threshold
+        self.chunk_size = chunk_size
+        self.verbose = verbose
+        # hash of the wave -> data file, so identical waves are written once
+        self.data_files = {}
+
+    # returns the breakpoints of a pwl wave as (time, value) arrays, or None for a pwl string
+    @staticmethod
+    def pwl_arrays(wave):
+        if isinstance(wave, str):
+            return None
+        if isinstance(wave, tuple) and len(wave) == 2:
+            return np.asarray(wave[0], dtype=np.float64), np.asarray(wave[1], dtype=np.float64)
+
+        wave = np.asarray(wave, dtype=np.float64)
+        if wave.ndim != 2 or wave.shape[1] != 2:
+            raise Exception(f"pwl 'wave' must be a string, (time, value) arrays or an (n, 2) array, found shape {wave.shape}")
+        return wave[:, 0], wave[:, 1]
+
+    def data_file(self, t, v):
+        """
+        Write a pwl wave to a data file (one 'time value' pair per line) and return its path
+        Waves which were already written are not written again
+        """
+        h = hashlib.sha1()
+        h.update(t.tobytes())
+        h.update(v.tobytes())
+        key = h.hexdigest()
+
+        if key not in self.data_files:
+            os.makedirs(self.data_dir, exist_ok=True)
+            path = os.path.join(self.data_dir, f'pwl_{key[:16]}.pwl')
+            if not os.path.exists(path):
+                tmp = path + '.tmp'
+                with open(tmp, 'w', buffering=1 << 20) as f:
+                    for start in range(0, len(t), self.chunk_size):
+                        chunk = np.column_stack((t[start:start + self.chunk_size], v[start:start + self.chunk_size]))
+                        f.write('\n'.join(f'{a!r} {b!r}' for a, b in chunk.tolist()))
+                        f.write('\n')
+                os.replace(tmp, path)
+            self.data_files[key] = path
+
+        return self.data_files[key]
+
+    def write(self, f, name, s, inst=None, nodes=None):
+        """
+        Write the source line of one stimulus to the open file f
+
+        Parameters
+        ----------
+        name : string
+            net driven by the source
+        s : dictionary
+            the stimulus, see Simulator.apply_stims. Missing keys are filled in with their defaults.
+        inst : string
+            instance name of the source, defaults to _<type><name>
+        nodes : string
+            terminals of the source, defaults to (<name> 0)
+
+        Returns
+        -------
+        False if the stimulus function is unknown
+        """
+        if 'function' not in s:
+            s['function'] = 'bit'
+
+        if 'type' not in s:
+            s['type'] = 'v'
+        elif s['type'] not in ['i', 'v']:
+            raise(Exception(f"stimulus 'type' must be 'i' or 'v', found {s['type']}"))
+
+        if 'current' in s:
+            s['voltage'] = s['current']
+
+        if inst is None:
+            inst = f"_{s['type']}{name}"
+        if nodes is None:
+            nodes = f"({name} 0)"
+        source = f"{inst} {nodes} {s['type']}source"
+
+        if s['function'] == 'bit':
+            for d in self.bit_defaults.keys():
+                if d not in s:
+                    s[d] = self.bit_defaults[d]
+
+            f.write(f"""{source} data="{s['data']}" rptstart=1 rpttimes=0 val1={s['val1']} val0={s['val0']} rise={s['rise']} fall={s['fall']} period={s['period']} type=bit\n""")
+        elif s['function'] == 'pwl':
+            arrays = self.pwl_arrays(s['wave'])
+            if arrays is None:
+                f.write(f"""{source} wave=\\[ {s['wave']} \\] type=pwl\n""")
+            elif self.file_threshold is not None and len(arrays[0]) > self.file_threshold:
+                f.write(f"""{source} type=pwl file="{self.data_file(*arrays)}"\n""")
+            else:
+                f.write(f"{source} wave=\\[ ")
+                for chunk in iter_pwl(*arrays, self.chunk_size):
+                    f.write(chunk + ' ')
+                f.write("\\] type=pwl\n")
+        elif s['function'] == 'dc':
+            f.write(f"""{source} dc={s['voltage']} type=dc\n""")
+        else:
+            print(f"Unknown stim function '{s['function']}'. Please use one of: \n\t{stim_functions}")
+            return False
+        return True
+
+    def compile_patterns(self, patterns, var='vp_pattern'):
+        """
+        Compile several stimulus patterns into one set of sources, the pattern is selected by the design variable var
+        (var = 0 selects patterns[0] and so on)
+
+        Parameters
+        ----------
+        patterns : list of stimuli dictionaries, each in the format of Simulator.apply_stims.
+                   A net without a stimulus in some pattern is driven to 0 in that pattern.
+
+        Returns
+        -------
+        dictionary of net name -> source lines. Nets with the same stimulus in every pattern get a single source.
+        """
+        names = []
+        for stims in patterns:
+            names += [n for n in stims if n not in names]
+
+        lines = {}
+        for name in names:
+            present = [k for k, stims in enumerate(patterns) if name in stims]
+            plain = {}
+            for k in present:
+                buf = io.StringIO()
+                if self.write(buf, name, patterns[k][name]):
+                    plain[k] = buf.getvalue()
+
+            if len(plain) == 0:
+                continue
+            if len(plain) == len(patterns) and len(set(plain.values())) == 1:
+                lines[name] = plain[present[0]]
+                continue
+
+            types = set(patterns[k][name]['type'] for k in plain)
+            if len(types) > 1:
+                raise Exception(f"stimulus of '{name}' must be the same type ('i' or 'v') in every pattern")
+            s_type = types.pop()
+
+            node = 'vp_' + re.sub(r'[^A-Za-z0-9_]', '_', name)
+            buf = io.StringIO()
+            chain = '0'
+            for i, k in enumerate(plain):
+                gain = f'1-min(abs({var}-{k}),1)'
+                if s_type == 'v':
+                    self.write(buf, name, patterns[k][name], f'_v{name}_p{k}', f'({node}_{k} 0)')
+                    # the selected pattern's voltage appears across its vcvs, the others are shorted
+                    top = name if i == len(plain) - 1 else f'{node}_s{i}'
+                    buf.write(f'_e{name}_p{k} ({top} {chain}) vcvs ({node}_{k} 0) gain={gain}\n')
+                    chain = top
+                else:
+                    self.write(buf, name, patterns[k][name], f'_i{name}_p{k}', f'(0 {node}_{k})')
+                    buf.write(f'_r{name}_p{k} ({node}_{k} 0) resistor r=1\n')
+                    buf.write(f'_g{name}_p{k} ({name} 0) vccs ({node}_{k} 0) gm={gain}\n')
+            lines[name] = buf.getvalue()
+
+        return lines
@@ -0,0 +1,212 @@
+# Sweep specs for Simulator.run. Every spec expands to a paramset (one list of values per parameter, all the same
+# length and zipped together), which is what paramAnalysis and the spectre backend run, and remembers how to label
+# the results again:
+#   Product       - every combination of the given values, results are reshaped onto the grid
+#   LatinHypercube - n samples stratified along every parameter range
+#   Sobol         - n quasi-random samples (needs scipy)
+#   MonteCarlo    - n random samples from uniform ranges or custom distributions
+#
+#   sweep = Product(w=[1e-6, 2e-6], l=[100e-9, 200e-9, 300e-9])
+#   sim.run(p_values=sweep)
+#   sim.labelled('/out').sel(w=2e-6)     # 3 x n_time, indexed by l
+
+import numpy as np
+import itertools
+
+try:
+    from scipy.stats import qmc
+except ImportError:
+    qmc = None
+
+
+class Sweep:
+    def __init__(self, names, coords):
+        # names of the parameters and one row of parameter values per point
+        self.names = list(names)
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, len(self.names))
+
+    def __len__(self):
+        return len(self.coords)
+
+    # the zipped lists passed to paramAnalysis
+    def p_values(self):
+        return {name: self.coords[:, i].tolist() for i, name in enumerate(self.names)}
+
+    # the axes of the labelled results, name -> values
+    def axes(self):
+        return {'point': np.arange(len(self))}
+
+    def shape(self):
+        return (len(self),)
+
+
+class Product(Sweep):
+    def __init__(self, **values):
+        """
+        Full factorial sweep over every combination of the values
+
+        Parameters
+        ----------
+        values : lists of numbers keyed on parameter name (eg. w=[1e-6, 2e-6], l=[100e-9, 200e-9])
+        """
+        self.values = {name: np.asarray(v, dtype=np.float64).ravel() for name, v in values.items()}
+        super().__init__(self.values.keys(), list(itertools.product(*self.values.values())))
+
+    def axes(self):
+        return dict(self.values)
+
+    def shape(self):
+        return tuple(len(v) for v in self.values.values())
+
+
+# scales samples in [0, 1) onto the (low, high) ranges
+def _scale(unit, ranges):
+    low = np.asarray([r[0] for r in ranges.values()], dtype=np.float64)
+    high = np.asarray([r[1] for r in ranges.values()], dtype=np.float64)
+    return low + unit * (high - low)
+
+
+class LatinHypercube(Sweep):
+    def __init__(self, n, seed=None, **ranges):
+        """
+        Latin hypercube sample: each parameter range is split into n strata which are each sampled once
+
+        Parameters
+        ----------
+        n : int
+            number of simulations
+        seed : int
+            random seed, for repeatable samples
+        ranges : (low, high) keyed on parameter name (eg. w=(1e-6, 5e-6))
+        """
+        rng = np.random.default_rng(seed)
+        d = len(ranges)
+        # one random permutation of the strata per parameter, jittered inside each stratum
+        strata = np.argsort(rng.random((d, n)), axis=1).T
+        unit = (strata + rng.random((n, d))) / n
+        super().__init__(ranges.keys(), _scale(unit, ranges))
+
+
+class Sobol(Sweep):
+    def __init__(self, n, seed=None, **ranges):
+        """
+        Scrambled Sobol sequence, n should be a power of 2
+
+        Parameters
+        ----------
+        n : int
+            number of simulations
+        seed : int
+            random seed for the scrambling
+        ranges : (low, high) keyed on parameter name (eg. w=(1e-6, 5e-6))
+        """
+        if qmc is None:
+            raise Exception('Sobol sweeps need scipy. Install it with: pip install scipy')
+        unit = qmc.Sobol(d=len(ranges), scramble=True, seed=seed).random(n)
+        super().__init__(ranges.keys(), _scale(unit, ranges))
+
+
+class MonteCarlo(Sweep):
+    def __init__(self, n, seed=None, **dists):
+        """
+        Random sample
+
+        Parameters
+        ----------
+        n : int
+            number of simulations
+        seed : int
+            random seed, for repeatable samples
+        dists : keyed on parameter name, either (low, high) for a uniform distribution or a function called with
+                a numpy Generator and n which returns n values (eg. vth=lambda rng, n: rng.normal(0.4, 0.02, n))
+        """
+        rng = np.random.default_rng(seed)
+        columns = []
+        for d in dists.values():
+            if callable(d):
+                columns.append(np.asarray(d(rng, n), dtype=np.float64))
+            else:
+                columns.append(rng.uniform(d[0], d[1], n))
+        super().__init__(dists.keys(), np.column_stack(columns))
+
+
+class LabelledArray:
+    def __init__(self, values, axes, coords=None):
+        """
+        Sweep results with one labelled axis per sweep dimension followed by the time axis
+
+        Parameters
+        ----------
+        values : np array of shape sweep.shape() + (n_time,), or an object array of rows for ragged results
+        axes : dictionary of axis name -> values along that axis
+        coords : dictionary of parameter name -> value at each point, for sweeps which are not on a grid
+                 (their results have a single 'point' axis)
+        """
+        self.values = values
+        self.axes = dict(axes)
+        self.coords = coords
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.values, dtype=dtype)
+
+    def __repr__(self):
+        return f'LabelledArray(axes={list(self.axes.keys())}, shape={self.shape})'
+
+    def sel(self, **selection):
+        """
+        Select by parameter value, eg. sel(w=2e-6). Selected axes are dropped from the result
+        For sweeps which are not on a grid, every point with that parameter value is kept
+        """
+        values = self.values
+        axes = dict(self.axes)
+        coords = self.coords
+        for name, value in selection.items():
+            if coords is not None and name in coords and 'point' in axes:
+                k = list(axes.keys()).index('point')
+                hits = np.flatnonzero(np.isclose(coords[name], value))
+                values = np.take(values, hits, axis=k)
+                axes['point'] = axes['point'][hits]
+                coords = {n: c[hits] for n, c in coords.items()}
+                continue
+
+            if name not in axes:
+                raise Exception(f"'{name}' is not an axis of these results. Axes: {list(axes.keys())}")
+
+            k = list(axes.keys()).index(name)
+            hits = np.flatnonzero(np.isclose(axes[name], value))
+            if len(hits) == 0:
+                raise Exception(f'{name}={value} is not in the sweep. Values: {axes[name]}')
+
+            values = np.take(values, hits[0], axis=k)
+            axes.pop(name)
+
+        if len(axes) == 0:
+            return values
+        return LabelledArray(values, axes, coords)
+
+
+def labelled(sweep, y):
+    """
+    Reshape sweep results (one row per point, in sweep order) onto the sweep's axes
+
+    Parameters
+    ----------
+    sweep : Sweep
+    y : (n_points, n_time) array, RaggedArray or list of np arrays
+    """
+    if isinstance(y, np.ndarray) and y.ndim == 2:
+        values = y.reshape(sweep.shape() + (y.shape[1],))
+    else:
+        rows = np.empty(len(sweep), dtype=object)
+        for i, row in enumerate(y):
+            rows[i] = np.asarray(row)
+        values = rows.reshape(sweep.shape())
+
+    coords = None
+    if not isinstance(sweep, Product):
+        coords = {name: sweep.coords[:, i] for i, name in enumerate(sweep.names)}
+    return LabelledArray(values, sweep.axes(), coords)
@@ -0,0 +1,135 @@
+# Splits a parametric sweep across several Virtuoso workspaces (see launch_scripts/launch_virtuoso_with_skillbridge.py)
+# Each workspace gets its own Schematic, Simulator and results directory and runs paramRun on its slice of the sweep.
+# The slices are merged back into the first simulator in the original sweep order.
+
+import numpy as np
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .Schematic import Schematic
+from .Simulator import Simulator
+from .Sweep import Sweep
+from .vp_utils import stack_sweep
+
+
+class SweepScheduler:
+    def __init__(self, lib_name, cell_name, ws_names, setup, model_files=None, view='schematic', verbose=True, **sim_kwargs):
+        """
+        Open the schematic and a simulator in each workspace
+
+        Parameters
+        ----------
+        lib_name : string
+            library of the schematic to simulate
+        cell_name : string
+            cell of the schematic to simulate
+        ws_names : int or list of strings
+            workspace ids (eg. ['user_0', 'user_1']), or a number n to use $USER_0 .. $USER_n-1
+        setup : function
+            called with each Simulator to configure it the same way (tran, apply_stims, track_net, track_custom ...)
+        model_files : list of strings
+            passed on to each Simulator
+        """
+        if isinstance(ws_names, int):
+            net_id = os.getenv('USER')
+            ws_names = [f'{net_id}_{i}' for i in range(ws_names)]
+
+        self.ws_names = ws_names
+        self.verbose = verbose
+        self.schematics = []
+        self.sims = []
+
+        for ws_name in ws_names:
+            # only netlisted, opening it for editing in every session would fight over the edit lock
+            sch = Schematic(lib_name, cell_name, ws_name=ws_name, verbose=verbose, read_only=True)
+            results_dir = os.getcwd() + f'/sim_output/{cell_name}_{ws_name}'
+            sim = Simulator(sch, model_files, view=view, verbose=verbose, results_dir=results_dir, **sim_kwargs)
+            setup(sim)
+            self.schematics.append(sch)
+            self.sims.append(sim)
+
+    # splits the paramset into one contiguous slice per workspace
+    def shard(self, p_values):
+        n_points = len(list(p_values.values())[0])
+        bounds = np.linspace(0, n_points, len(self.sims) + 1).astype(int)
+
+        shards = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if end > start:
+                shards.append({p: list(v[start:end]) for p, v in p_values.items()})
+            else:
+                shards.append(None)
+        return shards
+
+    def run(self, p_values):
+        """
+        Run a paramset sweep across all workspaces and merge the results
+
+        Parameters
+        ----------
+        p_values : dictionary or Sweep
+            parameter name -> list of values, all lists the same length (as in Simulator.run), or a sweep spec
+
+        Returns
+        -------
+        the first Simulator, holding the merged waves of the whole sweep (ready for plot()), or None if any slice failed
+        """
+        sweep = None
+        if isinstance(p_values, Sweep):
+            sweep = p_values
+            p_values = sweep.p_values()
+
+        lengths = [len(v) for v in p_values.values()]
+        if len(set(lengths)) != 1:
+            raise Exception(f'All parameter lists must be the same length, found {lengths}')
+
+        shards = self.shard(p_values)
+
+        def work(sim, shard):
+            if shard is None:
+                return 0
+            return sim.run(p_values=shard)
+
+        with ThreadPoolExecutor(max_workers=len(self.sims)) as ex:
+            results = list(ex.map(work, self.sims, shards))
+
+        if any(r is None for r in results):
+            if self.verbose:
+                failed = [ws for ws, r in zip(self.ws_names, results) if r is None]
+                print(f'Sweep failed on workspaces: {failed}')
+            return None
+
+        main = self.merge(p_values, shards)
+        main.sweep = sweep
+        return main
+
+    # concatenates the sweep points of each workspace into the first simulator
+    def merge(self, p_values, shards):
+        used = [sim for sim, shard in zip(self.sims, shards) if shard is not None]
+        main = self.sims[0]
+
+        x_rows = []
+        coords = []
+        for sim in used:
+            x_rows += list(sim.x)
+            if sim.sweep_coords is not None:
+                coords.append(sim.sweep_coords)
+
+        for name in main.waves:
+            if 'fn' in main.waves[name]:
+                continue
+            rows = []
+            for sim in used:
+                rows += list(sim.waves[name]['y'])
+            main.waves[name]['y'] = stack_sweep(rows)
+
+        main.param_sets = p_values
+        main.x = stack_sweep(x_rows)
+        main.sweep_coords = np.concatenate(coords) if len(coords) == len(used) else None
+        main.run_ok = True
+        main.invalidate_custom()
+        return main
+
+    def close(self):
+        for sch in self.schematics:
+            sch.close()
@@ -0,0 +1,136 @@
+# Memory-mapped storage for the waves of a run, so long transients do not have to stay in RAM.
+#
+# Each run is one column-major .npy file with one column per wave, the sweep points of a wave are stored one after
+# another in its column (offsets in the .json next to it). The time axis is stored once in <run>.x.npy when every
+# sweep point shares the same time grid, otherwise it is a column of the run file like the waves.
+# Waves are handed back as views into the memory-mapped file, so only the pages which are read are loaded.
+
+import numpy as np
+import json
+import glob
+import os
+
+from .vp_utils import RaggedArray
+
+
+class WaveStore:
+    def __init__(self, store_dir, keep=2):
+        """
+        Parameters
+        ----------
+        store_dir : string
+            directory for the run files (eg. ./sim_output/<cell>/waves)
+        keep : int
+            number of runs to keep on disk, older runs are removed when a new one is written
+        """
+        self.store_dir = store_dir
+        self.keep = keep
+        os.makedirs(store_dir, exist_ok=True)
+        runs = self.runs()
+        self.count = _run_number(runs[-1]) + 1 if len(runs) > 0 else 0
+
+    def write(self, x, waves, chunk_size=1 << 20):
+        """
+        Write the results of a run and return memory-mapped views of them
+
+        Parameters
+        ----------
+        x : np array for a single run, or (n_sweep, n_time) array, RaggedArray or list of np arrays for a sweep
+        waves : dictionary of wave name -> y, each shaped like x
+
+        Returns
+        -------
+        path of the run file, x and a dictionary of wave name -> y, shaped like the inputs but backed by the file
+        """
+        single = isinstance(x, np.ndarray) and x.ndim == 1
+        x_rows = [x] if single else list(x)
+        lengths = np.asarray([len(r) for r in x_rows])
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+
+        shared = all(l == lengths[0] for l in lengths) and all(np.array_equal(r, x_rows[0]) for r in x_rows[1:])
+
+        names = list(waves.keys())
+        columns = names if shared else ['x'] + names
+        path = os.path.join(self.store_dir, f'run_{self.count}.npy')
+        self.count += 1
+
+        matrix = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=np.float64,
+                                           shape=(int(offsets[-1]), len(columns)), fortran_order=True)
+        for c, name in enumerate(columns):
+            rows = x_rows if name == 'x' else ([waves[name]] if single else waves[name])
+            for r, row in enumerate(rows):
+                # copied in chunks so a memory-mapped source is not read in one go
+                for start in range(0, len(row), chunk_size):
+                    chunk = np.asarray(row[start:start + chunk_size], dtype=np.float64)
+                    matrix[offsets[r] + start:offsets[r] + start + len(chunk), c] = chunk
+        matrix.flush()
+        del matrix
+        os.replace(path + '.tmp', path)
+
+        if shared:
+            np.save(path[:-4] + '.x.npy', np.asarray(x_rows[0], dtype=np.float64))
+
+        with open(path[:-4] + '.json', 'w') as f:
+            json.dump({'names': names, 'columns': columns, 'offsets': offsets.tolist(), 'shared_x': bool(shared),
+                       'single': bool(single)}, f)
+
+        self.prune()
+        x, views = WaveStore.open(path)
+        return path, x, views
+
+    @staticmethod
+    def open(path):
+        """
+        Memory-map a run written by write()
+
+        Returns
+        -------
+        x and a dictionary of wave name -> y. For a sweep on a shared time grid they are (n_sweep, n_time) views
+        (x is broadcast, it is stored once), otherwise RaggedArrays
+        """
+        with open(path[:-4] + '.json', 'r') as f:
+            meta = json.load(f)
+
+        matrix = np.load(path, mmap_mode='r')
+        offsets = np.asarray(meta['offsets'], dtype=np.int64)
+        n_sweep = len(offsets) - 1
+        dense = meta['shared_x'] or np.all(np.diff(offsets) == offsets[1])
+
+        def view(c):
+            col = matrix[:, c]
+            if meta['single']:
+                return col
+            if dense:
+                return col.reshape(n_sweep, -1)
+            return RaggedArray(data=col, offsets=offsets)
+
+        waves = {name: view(meta['columns'].index(name)) for name in meta['names']}
+
+        if meta['shared_x']:
+            x = np.load(path[:-4] + '.x.npy', mmap_mode='r')
+            if not meta['single']:
+                x = np.broadcast_to(x, (n_sweep, len(x)))
+        else:
+            x = view(0)
+        return x, waves
+
+    # run files, oldest first
+    def runs(self):
+        return sorted(glob.glob(os.path.join(self.store_dir, 'run_*[0-9].npy')), key=_run_number)
+
+    def prune(self):
+        # open views of removed runs stay readable until they are closed
+        runs = self.runs()
+        for path in runs[:max(0, len(runs) - self.keep)]:
+            for p in [path, path[:-4] + '.x.npy', path[:-4] + '.json']:
+                if os.path.exists(p):
+                    os.remove(p)
+
+
+def _run_number(path):
+    return int(os.path.basename(path)[len('run_'):-len('.npy')])
+
+
+def window_indices(x, t0, t1):
+    # first and last+1 index of the samples of a sorted time axis inside [t0, t1], found by binary search
+    return np.searchsorted(x, t0, side='left'), np.searchsorted(x, t1, side='right')
@@ -0,0 +1,246 @@
+# Keeps SkillBridge workspaces open and leases them to Schematic, Layout and Simulator
+# Leased workspaces are wrapped so that a call failing on a dead connection reconnects and is retried once.
+# If the workspace does not come back it fails over to another live workspace which nobody is leasing. The session
+# state is then rebuilt by the on_failover callbacks (eg. Schematic.reopen, Simulator.setup_session) and calls which
+# pass remote objects of the lost session are not repeated.
+
+from skillbridge import Workspace
+from skillbridge.client.remote import RemoteVariable
+import regex as re
+import glob
+import os
+
+from .vp_skill import forget_workspace
+from .Instance import symbol_cache
+
+# raised by the socket when the SkillBridge server or Virtuoso goes away
+_connection_errors = (BrokenPipeError, ConnectionError, EOFError, OSError)
+
+
+class _PooledCall:
+    def __init__(self, pooled, path):
+        self._pooled = pooled
+        self._path = path
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _PooledCall(self._pooled, self._path + [('attr', name)])
+
+    def __getitem__(self, name):
+        return _PooledCall(self._pooled, self._path + [('item', name)])
+
+    def __call__(self, *args, **kwargs):
+        return self._pooled.call(self._path, args, kwargs)
+
+
+# whether any of the arguments is a remote object (eg. a cellview or drVector), also inside lists and dictionaries
+def _has_remote(args):
+    for a in args:
+        if isinstance(a, RemoteVariable):
+            return True
+        if isinstance(a, (list, tuple)) and _has_remote(a):
+            return True
+        if isinstance(a, dict) and _has_remote(a.values()):
+            return True
+    return False
+
+
+# raised instead of repeating a call whose remote objects belonged to the session which was lost
+class WorkspaceFailedOver(Exception):
+    pass
+
+
+# stands in for a skillbridge Workspace, eg. ws.db.open_cell_view(...) or ws['run']()
+class PooledWorkspace:
+    def __init__(self, pool, ws_name):
+        self.pool = pool
+        self.ws_name = ws_name
+        self.ws = Workspace.open(workspace_id=ws_name)
+        self.leases = 0
+        # called with this workspace after it failed over to a different Virtuoso,
+        # remote objects (eg. open cellviews) from the old session are no longer valid
+        self.on_failover = []
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _PooledCall(self, [('attr', name)])
+
+    def __getitem__(self, name):
+        return _PooledCall(self, [('item', name)])
+
+    def _resolve(self, path):
+        obj = self.ws
+        for kind, name in path:
+            obj = getattr(obj, name) if kind == 'attr' else obj[name]
+        return obj
+
+    def call(self, path, args, kwargs):
+        try:
+            return self._resolve(path)(*args, **kwargs)
+        except _connection_errors:
+            failed_over = self.pool.recover(self)
+            if failed_over and _has_remote(list(args) + list(kwargs.values())):
+                name = '.'.join(str(p[1]) for p in path)
+                raise WorkspaceFailedOver(f"Workspace failed over to {self.ws_name}, '{name}' was not repeated since "
+                                          f"its arguments belong to the lost session. Open them again and retry.")
+            return self._resolve(path)(*args, **kwargs)
+
+    def ping(self):
+        try:
+            return self.ws['plus'](1, 1) == 2
+        except Exception:
+            return False
+
+    # closing a leased workspace returns it to the pool, the connection stays open
+    def close(self):
+        self.pool.release(self)
+
+
+class WorkspacePool:
+    def __init__(self, ws_names=None, verbose=True):
+        """
+        Parameters
+        ----------
+        ws_names : list of strings
+            workspace ids to use (eg. ['user_0', 'user_1']), None to discover the running SkillBridge servers
+        """
+        self.verbose = verbose
+        if ws_names is None:
+            ws_names = self.discover()
+        if len(ws_names) == 0:
+            raise Exception('No SkillBridge servers found. Start one with launch_scripts/launch_virtuoso_with_skillbridge.py')
+
+        self.ws_names = list(ws_names)
+        # ws_name -> PooledWorkspace, connected on first lease
+        self.workspaces = {}
+
+    # finds running SkillBridge servers of the current user from their sockets
+    @staticmethod
+    def discover(user=None):
+        if user is None:
+            user = os.getenv('USER')
+
+        ids = []
+        for path in sorted(glob.glob('/tmp/skill-server-*.sock')):
+            m = re.match(r'skill-server-(.*)\.sock$', os.path.basename(path))
+            if m and (user is None or m.group(1).startswith(user)):
+                ids.append(m.group(1))
+        return ids
+
+    def _connect(self, ws_name):
+        if ws_name not in self.workspaces:
+            self.workspaces[ws_name] = PooledWorkspace(self, ws_name)
+        return self.workspaces[ws_name]
+
+    def lease(self, ws_name=None):
+        """
+        Lease a workspace, reusing its open connection
+
+        Parameters
+        ----------
+        ws_name : string
+            workspace id to lease, None for the least used live workspace
+        """
+        candidates = [ws_name] if ws_name is not None else sorted(
+            self.ws_names, key=lambda n: self.workspaces[n].leases if n in self.workspaces else 0)
+
+        for name in candidates:
+            try:
+                pooled = self._connect(name)
+                if not pooled.ping():
+                    self.reconnect(pooled)
+            except Exception:
+                continue
+
+            pooled.leases += 1
+            return pooled
+
+        raise Exception(f'No live workspace available among {candidates}')
+
+    def release(self, pooled):
+        pooled.leases = max(0, pooled.leases - 1)
+
+    def reconnect(self, pooled, ws_name=None):
+        if ws_name is None:
+            ws_name = pooled.ws_name
+        try:
+            pooled.ws.close()
+        except Exception:
+            pass
+
+        pooled.ws = Workspace.open(workspace_id=ws_name)
+        pooled.ws_name = ws_name
+        # SKILL helpers have to be defined again in a new session and its symbol cellviews opened again
+        forget_workspace(pooled)
+        symbol_cache.forget_workspace(pooled)
+
+    def recover(self, pooled):
+        """
+        Called when a call on a pooled workspace hits a dead connection. Reconnects to the same workspace, or fails
+        over to a live workspace which is not leased (its idle connection is replaced) and runs pooled.on_failover
+
+        Returns
+        -------
+        True if the workspace failed over to a different session, False if it reconnected to the same one
+        """
+        old_name = pooled.ws_name
+        try:
+            self.reconnect(pooled)
+            if pooled.ping():
+                if self.verbose:
+                    print(f'Reconnected to workspace {old_name}')
+                return False
+        except Exception:
+            pass
+
+        for name in self.ws_names:
+            idle = self.workspaces.get(name)
+            if name == old_name or (idle is not None and idle.leases > 0):
+                continue
+
+            # a SkillBridge server takes one client, the idle connection is closed first
+            if idle is not None:
+                try:
+                    idle.ws.close()
+                except Exception:
+                    pass
+            try:
+                self.reconnect(pooled, name)
+            except Exception:
+                continue
+            if not pooled.ping():
+                continue
+
+            # pooled now is the session of name, the dead workspace is connected again when it is leased next
+            self.workspaces.pop(old_name, None)
+            self.workspaces[name] = pooled
+            if self.verbose:
+                print(f'Workspace {old_name} failed, switched to {name}')
+            for fn in list(pooled.on_failover):
+                fn(pooled)
+            return True
+
+        pooled.ws_name = old_name
+        raise Exception(f'Workspace {old_name} is not responding and no other workspace is available')
+
+    # pings every open workspace and reconnects the ones which are not responding
+    def check(self):
+        healthy = {}
+        for name, pooled in list(self.workspaces.items()):
+            if not pooled.ping():
+                try:
+                    self.recover(pooled)
+                except Exception:
+                    pass
+            healthy[name] = pooled.ping()
+        return healthy
+
+    def close(self):
+        for pooled in self.workspaces.values():
+            try:
+                pooled.ws.close()
+            except Exception:
+                pass
+        self.workspaces = {}
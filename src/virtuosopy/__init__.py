@@ -1,6 +1,15 @@
 from .Schematic import Schematic
 from .Layout import Layout
 from .Simulator import Simulator
+from .Instance import symbol_cache
+from .PSFReader import PSFFile, load_psf_waves
+from .ResultCache import ResultCache
+from .SpectreBackend import SpectreBackend
+from .Stimuli import StimulusCompiler
+from .Sweep import Product, LatinHypercube, Sobol, MonteCarlo
+from .SweepScheduler import SweepScheduler
+from .WaveStore import WaveStore
+from .WorkspacePool import WorkspacePool
 from .vp_utils import *
 
 __version__ = 0.01
\ No newline at end of file
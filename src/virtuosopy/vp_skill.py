@@ -0,0 +1,238 @@
+# SKILL helper procedures which are defined inside Virtuoso on first use.
+# They let large amounts of data cross SkillBridge in a single call instead of one call per element.
+
+# name -> SKILL source
+skill_procedures = {}
+
+# returns the elements [start, end) of a drVector as a SKILL list
+skill_procedures['vpDrVectorSlice'] = '''
+procedure(vpDrVectorSlice(vec start end)
+    let((out)
+        for(i start end-1
+            out = cons(drGetElem(vec i) out)
+        )
+        reverse(out)
+    )
+)
+'''
+
+# returns every leaf of a (nested) parametric family as list(coords ylist xlist)
+# coords holds the sweep values from the outermost family inwards, xlist is nil unless withX is t
+skill_procedures['vpFamilyLeaves'] = '''
+procedure(vpFamilyLeaves(wave withX)
+    let((xvec yvec n out)
+        xvec = drGetWaveformXVec(wave)
+        yvec = drGetWaveformYVec(wave)
+        n = drVectorLength(yvec)
+        if(n > 0 && drIsWaveform(drGetElem(yvec 0)) then
+            for(i 0 n-1
+                foreach(leaf vpFamilyLeaves(drGetElem(yvec i) withX)
+                    out = cons(cons(cons(drGetElem(xvec i) car(leaf)) cdr(leaf)) out)
+                )
+            )
+            reverse(out)
+        else
+            list(list(nil vpDrVectorSlice(yvec 0 n) when(withX vpDrVectorSlice(xvec 0 drVectorLength(xvec)))))
+        )
+    )
+)
+'''
+
+# returns the CDF parameters of a cell as list(list(name defValue) ...)
+skill_procedures['vpCellCDFParams'] = '''
+procedure(vpCellCDFParams(lib cell)
+    let((cdf out)
+        cdf = cdfGetBaseCellCDF(ddGetObj(lib cell))
+        when(cdf
+            foreach(p cdf->parameters
+                out = cons(list(p->name p->defValue) out)
+            )
+        )
+        reverse(out)
+    )
+)
+'''
+
+# applies a list of schematic edits recorded by Schematic.batch() and returns one result per edit:
+#   list("inst" lib cell name xy orient)                  -> instance
+#   list("param" instName paramName value)                -> nil
+#   list("wire" mode points snap label labelXY [sig])     -> list of wires
+#   list("pin" pinCell name direction xy orient)          -> pin instance
+#   list("note" text xy size [sig])                       -> nil
+#   list("params" instName names)                         -> nil, stores names in the vpParams property
+# param ops only write values which differ, wires and notes are tagged with sig (see vpTag) when it is given
+skill_procedures['vpBatch'] = '''
+procedure(vpBatch(cv ops)
+    let((out kind res)
+        foreach(op ops
+            kind = car(op)
+            res = nil
+            cond(
+                (kind == "inst"
+                    res = schCreateInst(cv dbOpenCellViewByType(nth(1 op) nth(2 op) "symbol") nth(3 op) nth(4 op) nth(5 op)))
+                (kind == "param"
+                    let((param)
+                        param = cdfFindParamByName(cdfGetInstCDF(dbFindAnyInstByName(cv nth(1 op))) nth(2 op))
+                        when(param && param->value != nth(3 op) param->value = nth(3 op))))
+                (kind == "wire"
+                    res = schCreateWire(cv nth(1 op) "full" nth(2 op) nth(3 op) nth(3 op) 0.0)
+                    when(nth(6 op) vpTag(res nth(6 op)))
+                    when(nth(4 op)
+                        let((label)
+                            label = schCreateWireLabel(cv car(res) nth(5 op) nth(4 op) "upperLeft" "R0" "fixed" nth(3 op) nil)
+                            when(nth(6 op) vpTag(list(label) nth(6 op))))))
+                (kind == "pin"
+                    res = schCreatePin(cv dbOpenCellViewByType("basic" nth(1 op) "symbol") nth(2 op) nth(3 op) nil nth(4 op) nth(5 op)))
+                (kind == "note"
+                    let((note)
+                        note = schCreateNoteLabel(cv nth(2 op) nth(1 op) "lowerLeft" "R0" "fixed" nth(3 op) "normalLabel")
+                        when(nth(4 op) vpTag(list(note) nth(4 op)))))
+                (kind == "params"
+                    dbReplaceProp(dbFindAnyInstByName(cv nth(1 op)) "vpParams" "string" nth(2 op)))
+            )
+            out = cons(res out)
+        )
+        reverse(out)
+    )
+)
+'''
+
+# returns the current value of each list(instName paramName) query, nil for unknown parameters
+skill_procedures['vpGetParams'] = '''
+procedure(vpGetParams(cv queries)
+    foreach(mapcar q queries
+        let((param)
+            param = cdfFindParamByName(cdfGetInstCDF(dbFindAnyInstByName(cv car(q))) cadr(q))
+            when(param param->value)
+        )
+    )
+)
+'''
+
+# stores sig in the vpSig property of each object so incremental regeneration can recognise it later
+skill_procedures['vpTag'] = '''
+procedure(vpTag(objs sig)
+    foreach(o objs
+        when(o dbReplaceProp(o "vpSig" "string" sig))
+    )
+    objs
+)
+'''
+
+# reads the objects of a schematic for incremental regeneration as list(insts pins shapes):
+#   insts  list(name lib cell xy orient params inst) of every instance which is not a pin, params is its vpParams
+#          property (the parameters set by the last incremental run) or nil
+#   pins   list(name cell xy orient inst) of every pin
+#   shapes list(sig shape) of every shape (wires, labels, notes), sig is nil for shapes without a vpSig property
+skill_procedures['vpReadSchematic'] = '''
+procedure(vpReadSchematic(cv)
+    let((insts pins shapes)
+        foreach(i cv->instances
+            if(i->purpose == "pin" && i->pin then
+                pins = cons(list(i->pin->term->name i->cellName i->xy i->orient i) pins)
+            else
+                insts = cons(list(i->name i->libName i->cellName i->xy i->orient i->vpParams i) insts)
+            )
+        )
+        foreach(s cv->shapes
+            shapes = cons(list(s->vpSig s) shapes)
+        )
+        list(insts pins shapes)
+    )
+)
+'''
+
+# deletes a list of objects, ignoring objects which were already removed with their parent
+skill_procedures['vpDelete'] = '''
+procedure(vpDelete(objs)
+    foreach(o objs
+        errset(dbDeleteObject(o))
+    )
+    length(objs)
+)
+'''
+
+# returns list(path modifiedTime) of the files of a cell (eg. its CDF in data.dm) and of one of its views
+skill_procedures['vpViewStamps'] = '''
+procedure(vpViewStamps(lib cell view)
+    let((out)
+        foreach(obj list(ddGetObj(lib cell) ddGetObj(lib cell view))
+            when(obj
+                foreach(f getDirFiles(obj->readPath)
+                    unless(member(f list("." ".."))
+                        out = cons(list(strcat(obj->readPath "/" f) fileTimeModified(strcat(obj->readPath "/" f))) out)
+                    )
+                )
+            )
+        )
+        out
+    )
+)
+'''
+
+# returns the vpViewStamps of every cell in the hierarchy below lib/cell/view
+# masters are followed into their schematic view where they have one, their symbol view otherwise
+skill_procedures['vpHierarchyStamps'] = '''
+procedure(vpHierarchyStamps(lib cell view @optional seen)
+    let((cv opened out key)
+        unless(seen seen = makeTable("vpSeen" nil))
+        key = strcat(lib "/" cell "/" view)
+        unless(seen[key]
+            seen[key] = t
+            out = vpViewStamps(lib cell view)
+            ; cellviews which were already open (eg. the one being edited) are left open
+            cv = ddGetObj(lib) && dbFindOpenCellView(ddGetObj(lib) cell view)
+            unless(cv
+                cv = opened = dbOpenCellViewByType(lib cell view nil "r")
+            )
+            when(cv
+                foreach(h cv->instHeaders
+                    out = append(out vpHierarchyStamps(h->libName h->cellName
+                        if(ddGetObj(h->libName h->cellName "schematic") "schematic" "symbol") seen))
+                )
+            )
+            when(opened dbClose(opened))
+        )
+        out
+    )
+)
+'''
+
+# helpers which must be defined before the key
+skill_requires = {}
+skill_requires['vpHierarchyStamps'] = ['vpViewStamps']
+skill_requires['vpBatch'] = ['vpTag']
+skill_requires['vpFamilyLeaves'] = ['vpDrVectorSlice']
+
+# workspaces (by id) and the procedures which have already been defined in them
+_defined = {}
+
+
+def define_skill(ws, name):
+    """
+    Define the SKILL helper procedure called name in the workspace if it has not been defined yet
+
+    Parameters
+    ----------
+    ws : skillbridge Workspace
+        workspace to define the procedure in
+    name : string
+        one of the keys in skill_procedures (eg. 'vpDrVectorSlice')
+    """
+    defined = _defined.setdefault(id(ws), set())
+    if name in defined:
+        return
+
+    if name not in skill_procedures:
+        raise Exception(f"Unknown SKILL helper '{name}'. Available helpers: {list(skill_procedures.keys())}")
+
+    for r in skill_requires.get(name, []):
+        define_skill(ws, r)
+
+    ws['evalstring'](skill_procedures[name])
+    defined.add(name)
+
+
+def forget_workspace(ws):
+    # call when a workspace is closed or reconnected so helpers are redefined on the next use
+    _defined.pop(id(ws), None)
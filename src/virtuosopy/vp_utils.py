@@ -55,17 +55,11 @@ def print_info(instance):
 
 
 def transform(pos):
-    t_pos = []
-    for n in pos:
-        t_pos.append(n * snap_spacing)
-    return np.asarray(t_pos)
+    return np.asarray(pos, dtype=float) * snap_spacing
 
 
 def i_transform(pos):
-    t_pos = []
-    for n in pos:
-        t_pos.append(n / snap_spacing)
-    return np.asarray(t_pos)
+    return np.asarray(pos, dtype=float) / snap_spacing
 
 
 # from https://stackoverflow.com/questions/34372480/rotate-point-about-another-point-in-degrees-python
@@ -86,6 +80,52 @@ def calc_center(bBox):
     return [x, y]
 
 
+# splits an orientation (eg. 'R90', 'MX', 'MYR90') into the mirrored axis ('X', 'Y' or False) and the rotation in degrees
+def parse_orient(orient):
+    if orient[0] != 'M':
+        return False, int(orient[1:])
+    if len(orient) > 2:
+        return orient[1], int(orient[3:])
+    return orient[1], 0
+
+
+# orientation -> 2x2 matrix which mirrors and then rotates counter clockwise, filled in by orient_matrix
+orient_table = {}
+
+
+def orient_matrix(orient):
+    if orient not in orient_table:
+        mirrored, degrees = parse_orient(orient)
+
+        M = np.eye(2)
+        if mirrored == 'Y':
+            M[0, 0] = -1
+        elif mirrored == 'X':
+            M[1, 1] = -1
+
+        # multiples of 90 degrees get exact integer matrices
+        if degrees % 90 == 0:
+            c, s = [(1, 0), (0, 1), (-1, 0), (0, -1)][(degrees // 90) % 4]
+        else:
+            angle = np.deg2rad(degrees)
+            c, s = np.cos(angle), np.sin(angle)
+        R = np.array([[c, -s], [s, c]], dtype=float)
+
+        orient_table[orient] = R @ M
+
+    return orient_table[orient]
+
+
+# positions of all pins of an instance in virtuoso coords
+# bboxes - (N, 2, 2) array of pin bounding boxes in symbol coords
+# vpos - position of the instance in virtuoso coords
+# orient - orientation of the instance (eg. 'R0', 'MX', 'MYR90')
+def place_pins(bboxes, vpos, orient):
+    bboxes = np.asarray(bboxes, dtype=float).reshape(-1, 2, 2)
+    centers = bboxes[:, 0, :] + (bboxes[:, 1, :] - bboxes[:, 0, :]) / 2
+    return centers @ orient_matrix(orient).T + np.asarray(vpos, dtype=float)
+
+
 class internal_iter:
     def __init__(self, obj, keys):
         self._obj = obj
@@ -95,43 +135,121 @@ class internal_iter:
     def __next__(self):
         return getattr(self._obj, next(self._iter))
 
-def create_wave(voltages, period, rise_time = 200e-12):
-    v_cycle = []
-    for i, v in enumerate(voltages):
-        v_cycle.append((i*period, v))
+# rows of different lengths (eg. one wave per sweep point with different time grids) stored in one flat array
+# row i is data[offsets[i]:offsets[i+1]]
+class RaggedArray:
+    def __init__(self, rows=None, data=None, offsets=None):
+        if rows is not None:
+            rows = [np.asarray(r) for r in rows]
+            offsets = np.concatenate(([0], np.cumsum([len(r) for r in rows])))
+            data = np.concatenate(rows) if len(rows) > 0 else np.empty(0)
+
+        self.data = np.asarray(data)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    # indexes like the list of rows it replaces: y[i] is a row, y[1:] or y[[0, 2]] a RaggedArray of rows,
+    # y[:, -1] the last sample of every row and y[:, :10] the first samples of every row
+    def __getitem__(self, i):
+        if isinstance(i, tuple):
+            rows, cols = i
+            if isinstance(rows, (int, np.integer)):
+                return self[rows][cols]
+            picked = [row[cols] for row in self[rows]]
+            if isinstance(cols, (int, np.integer)):
+                return np.asarray(picked)
+            return stack_sweep(picked)
+
+        if isinstance(i, (int, np.integer)):
+            if i < 0:
+                i += len(self)
+            if i < 0 or i >= len(self):
+                raise IndexError(f'row {i} is out of range for {len(self)} rows')
+            return self.data[self.offsets[i]:self.offsets[i + 1]]
+
+        if isinstance(i, slice):
+            return RaggedArray([self[k] for k in range(len(self))[i]])
+
+        # a list of row numbers or a boolean mask
+        return RaggedArray([self[k] for k in np.arange(len(self))[np.asarray(i)]])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    # the rows as an object array, the rows can not be joined into one numeric array
+    def __array__(self, dtype=None, copy=None):
+        if dtype is not None and np.dtype(dtype) != object:
+            raise TypeError(f'rows of different lengths can not be converted to a {np.dtype(dtype)} array, index the rows instead')
+        out = np.empty(len(self), dtype=object)
+        for i, row in enumerate(self):
+            out[i] = row
+        return out
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+
+# stacks one array per sweep point into a dense (n_sweep, n_time) array when they all have the same length
+# otherwise returns a RaggedArray
+def stack_sweep(rows):
+    if len(rows) > 0 and all(len(r) == len(rows[0]) for r in rows):
+        return np.stack([np.asarray(r) for r in rows])
+    return RaggedArray(rows)
 
+
+def create_wave(voltages, period, rise_time = 200e-12):
+    v_cycle = [(i*period, v) for i, v in enumerate(voltages)]
     return get_tv_pairs(v_cycle, rise_time)
 
+# same breakpoints as create_wave as (time, value) np arrays, for long waves (see Stimuli.StimulusCompiler)
+# the voltages have to be numbers here, create_wave also takes names (eg. 'vdd')
+def create_wave_arrays(voltages, period, rise_time = 200e-12):
+    voltages = np.asarray(voltages, dtype=np.float64)
+    return tv_pairs_to_arrays(np.column_stack((np.arange(len(voltages)) * period, voltages)), rise_time)
+
 # given a list of (time, voltage) pairs, returns a string for a pwl stimuli
 # vcycle = [(0., 3.3), (1*period, 1.5), (2*period, 3.3)]
+# values are written with str(), so 0 stays '0' and names like 'vdd' are passed through
 def get_tv_pairs(v_cycle, rise_time = 200e-12):
-    
-
-    add_rt = 0
     tv_pairs = []
-    for i in range(len(v_cycle)):
-        t = str(v_cycle[i][0] + rise_time * add_rt)
-        v = str(v_cycle[i][1])
-        tv_pairs.append(t)
-        tv_pairs.append(v)
-        # vw[f't{i*2+1}'] = str(v_cycle[i][0] + rise_time * add_rt)
-        # vw[f'v{i*2+1}'] = str(v_cycle[i][1])
-
-        # check we arent on the last v_cycle
+    for i, (t, v) in enumerate(v_cycle):
+        # the start of the level, after the ramp from the previous level
+        tv_pairs += [str(t + rise_time * (i > 0)), str(v)]
+        # the end of the level
         if i < len(v_cycle) - 1:
-            t = str(v_cycle[i+1][0])
-            v = str(v_cycle[i][1])
-            tv_pairs.append(t)
-            tv_pairs.append(v)
-            # vw[f't{i*2+2}'] = str(v_cycle[i+1][0])
-            # vw[f'v{i*2+2}'] = str(v_cycle[i][1])
-            add_rt = 1
-
-    # for i, (t, v) in enumerate(tv_pairs):
-    #     vw[f't{i+1}'] = t
-    #     vw[f'v{i+1}'] = v
-    
-    return str(tv_pairs).replace('[', '').replace(']', '').replace(',', '').replace("'", '')
+            tv_pairs += [str(v_cycle[i + 1][0]), str(v)]
+    return ' '.join(tv_pairs)
+
+# each voltage is held until the next time and then ramps to the next voltage over rise_time
+# returns the breakpoints of get_tv_pairs as (time, value) np arrays, for numeric voltages
+def tv_pairs_to_arrays(v_cycle, rise_time = 200e-12):
+    v_cycle = np.asarray(v_cycle, dtype=np.float64).reshape(-1, 2)
+    times = v_cycle[:, 0]
+    values = v_cycle[:, 1]
+    n = len(times)
+
+    t = np.empty(max(2 * n - 1, 0))
+    v = np.empty(max(2 * n - 1, 0))
+    # the start of each level, after the ramp from the previous level
+    t[0::2] = times + rise_time * (np.arange(n) > 0)
+    v[0::2] = values
+    # the end of each level
+    t[1::2] = times[1:]
+    v[1::2] = values[:-1]
+    return t, v
+
+# 't0 v0 t1 v1 ...' with every number written exactly (shortest repr which reads back to the same float)
+def format_pwl(t, v, chunk_size=100000):
+    return ' '.join(iter_pwl(t, v, chunk_size))
+
+# the pwl string of format_pwl in chunks of chunk_size breakpoints, for writing long waves without building one string
+def iter_pwl(t, v, chunk_size=100000):
+    pairs = np.column_stack((np.asarray(t, dtype=np.float64), np.asarray(v, dtype=np.float64)))
+    for start in range(0, len(pairs), chunk_size):
+        yield ' '.join(map(repr, pairs[start:start + chunk_size].ravel().tolist()))
 
 
 # convert strings like 400n to 400e-9 or 0.4u to 400e-9
@@ -175,6 +293,26 @@ def convert_str_to_num(string):
     
     return num
 
+# converts a parameter value (eg. 1e-6, '1u', '0.5') to a float, NaN if it is not a number (eg. 'nfet', 'w_read')
+def to_float(value):
+    if isinstance(value, bool) or value is None:
+        return np.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+
+    if not re.fullmatch(r'\d+\.?\d*[a-zA-Z]', str(value)):
+        return np.nan
+    num = convert_str_to_num(value)
+    return float(num) if not isinstance(num, str) else np.nan
+
+# (n_points, n_params) array of the values of a paramset (dictionary of equal length lists), see to_float
+def paramset_coords(p_values):
+    return np.column_stack([np.asarray([to_float(v) for v in values], dtype=np.float64) for values in p_values.values()])
+
 # ([pin of other instance, pin_name], direction)
 class ConnPos:
     def __init__(self, external_pin, internal_pin, direction, offset=10, net_name=None, add_pin=False):
@@ -0,0 +1,50 @@
+import collections
+
+import pytest
+
+
+class _Call:
+    def __init__(self, ws, name):
+        self.ws = ws
+        self.name = name
+
+    def __call__(self, *args, **kwargs):
+        self.ws.calls[self.name] += 1
+        if self.name not in self.ws.impl:
+            raise AttributeError(f"FakeWorkspace has no '{self.name}'")
+        return self.ws.impl[self.name](*args, **kwargs)
+
+
+class _Namespace:
+    def __init__(self, ws, prefix):
+        self.ws = ws
+        self.prefix = prefix
+
+    def __getattr__(self, name):
+        return _Call(self.ws, self.prefix + '.' + name)
+
+
+# stands in for a skillbridge Workspace: ws.dr.vector_length(...) calls impl['dr.vector_length'] and ws['vpBatch'](...)
+# calls impl['vpBatch'], every call is counted in calls. SKILL helpers are accepted by evalstring without running them
+class FakeWorkspace:
+    def __init__(self, impl=None):
+        self.impl = {'evalstring': lambda source: True}
+        self.impl.update(impl or {})
+        self.calls = collections.Counter()
+
+    def __getitem__(self, name):
+        return _Call(self, name)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return _Namespace(self, name)
+
+    # calls made, not counting the helper definitions
+    def rpc_count(self):
+        return sum(n for name, n in self.calls.items() if name != 'evalstring')
+
+
+@pytest.fixture
+def fake_ws():
+    return FakeWorkspace
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from virtuosopy.Simulator import Simulator
+
+
+class Vector(list):
+    pass
+
+
+class Waveform:
+    def __init__(self, x, y):
+        self.x = Vector(x)
+        self.y = Vector(y)
+
+
+# the OCEAN data access functions and the vpDrVectorSlice / vpFamilyLeaves helpers on Python waveforms
+def dr_impl():
+    def leaves(wave, with_x):
+        if len(wave.y) > 0 and isinstance(wave.y[0], Waveform):
+            return [[[x] + (leaf[0] or []), leaf[1], leaf[2]]
+                    for x, sub in zip(wave.x, wave.y) for leaf in leaves(sub, with_x)]
+        return [[None, list(wave.y), list(wave.x) if with_x else None]]
+
+    return {
+        'dr.vector_length': len,
+        'dr.get_elem': lambda vec, i: vec[i],
+        'dr.get_waveform_x_vec': lambda wave: wave.x,
+        'dr.get_waveform_y_vec': lambda wave: wave.y,
+        'vpDrVectorSlice': lambda vec, start, end: list(vec[start:end]),
+        'vpFamilyLeaves': leaves,
+    }
+
+
+class Schematic:
+    def __init__(self, ws):
+        self.ws = ws
+
+
+def simulator(ws, bulk_transfer, chunk_size=100):
+    sim = Simulator.__new__(Simulator)
+    sim.sch = Schematic(ws)
+    sim.bulk_transfer = bulk_transfer
+    sim.bulk_chunk_size = chunk_size
+    sim.param_sets = None
+    sim.sweep_coords = None
+    return sim
+
+
+def assert_identical(a, b):
+    assert a.dtype == b.dtype
+    assert a.shape == b.shape
+    assert a.tobytes() == b.tobytes()
+
+
+rng = np.random.default_rng(0)
+VALUES = {
+    'real': rng.standard_normal(1000).tolist(),
+    # eg. the output of an ac analysis
+    'complex': (rng.standard_normal(1000) + 1j * rng.standard_normal(1000)).tolist(),
+}
+
+
+@pytest.mark.parametrize('kind', VALUES)
+def test_vector_to_array_matches_per_element(fake_ws, kind):
+    vec = Vector(VALUES[kind])
+
+    bulk_ws = fake_ws(dr_impl())
+    bulk = simulator(bulk_ws, True).vector_to_array(vec)
+    elem_ws = fake_ws(dr_impl())
+    elem = simulator(elem_ws, False).vector_to_array(vec)
+
+    assert_identical(bulk, elem)
+    # one call for the length and one per chunk instead of one per element
+    assert bulk_ws.rpc_count() == 1 + 10
+    assert elem_ws.rpc_count() == 1 + 1000
+
+
+@pytest.mark.parametrize('kind', VALUES)
+def test_param_waveform_matches_per_element(fake_ws, kind):
+    # a two level family (vdd x temp), the leaves carry the waves
+    t = np.linspace(0, 1e-9, 50).tolist()
+    y = VALUES[kind]
+    family = Waveform([1.0, 1.2], [Waveform([27.0, 85.0], [Waveform(t, y[i * 50:(i + 1) * 50]) for i in range(j, j + 2)])
+                                   for j in (0, 2)])
+
+    bulk_ws = fake_ws(dr_impl())
+    bulk_y, bulk_x = simulator(bulk_ws, True).param_waveform_to_vector([family, family])
+    elem_ws = fake_ws(dr_impl())
+    elem_y, elem_x = simulator(elem_ws, False).param_waveform_to_vector([family, family])
+
+    for b, e in zip(bulk_y, elem_y):
+        assert_identical(b, np.stack(e))
+    assert_identical(bulk_x, np.stack(elem_x))
+    assert bulk_ws.rpc_count() == 2
+    assert bulk_ws.rpc_count() < elem_ws.rpc_count()
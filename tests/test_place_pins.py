@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from virtuosopy.vp_utils import calc_center, i_transform, orient_matrix, parse_orient, place_pins, rotate, transform
+
+
+ORIENTS = ['R0', 'R90', 'R180', 'R270', 'MX', 'MY', 'MXR90', 'MYR90']
+
+# pin bBoxes of a symbol in Virtuoso coordinates, off the origin and not square so every orientation differs
+BBOXES = [[[-0.0375, 0.1625], [0.0125, 0.2125]],
+          [[0.2375, -0.0125], [0.2875, 0.0375]],
+          [[-0.05, -0.6], [0.1, -0.4]]]
+
+
+# how _Pins placed pins one at a time: mirror the pin center, move it to the instance, then rotate about the instance
+def scalar_pin(bbox, vpos, orient):
+    mirrored, degrees = parse_orient(orient)
+    pos = np.asarray(calc_center(bbox))
+    if mirrored == 'Y':
+        pos[0] = -pos[0]
+    elif mirrored == 'X':
+        pos[1] = -pos[1]
+
+    pos = [pos[0] + vpos[0], pos[1] + vpos[1]]
+    pos = rotate(pos, vpos, degrees)
+    return i_transform(pos)
+
+
+@pytest.mark.parametrize('orient', ORIENTS)
+def test_place_pins_matches_scalar_path(orient):
+    vpos = transform([12, -7])
+
+    placed = i_transform(place_pins(BBOXES, vpos, orient))
+    expected = np.array([scalar_pin(bbox, vpos, orient) for bbox in BBOXES])
+
+    assert placed.shape == (len(BBOXES), 2)
+    np.testing.assert_allclose(placed, expected, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('orient', ORIENTS)
+def test_orient_matrix(orient):
+    M = orient_matrix(orient)
+
+    # the columns are where the scalar path takes the unit vectors
+    mirrored, degrees = parse_orient(orient)
+    for axis in range(2):
+        e = np.eye(2)[axis]
+        if mirrored == 'Y':
+            e[0] = -e[0]
+        elif mirrored == 'X':
+            e[1] = -e[1]
+        np.testing.assert_allclose(M[:, axis], rotate(e, degrees=degrees), rtol=0, atol=1e-15)
+
+    # quarter turns are exact, so pins stay on the grid
+    assert np.array_equal(M, np.round(M))
@@ -0,0 +1,127 @@
+import os
+import shutil
+import time
+
+import numpy as np
+import pytest
+
+from virtuosopy.PSFReader import PSFFile, find_psf_files, load_psf_waves
+
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'data', 'psf', 'tran.tran')
+
+
+# PSFFile writes its .npy cache next to the file, so every test reads a copy
+@pytest.fixture
+def tran(tmp_path):
+    path = tmp_path / 'psf' / 'tran.tran'
+    path.parent.mkdir()
+    shutil.copy(FIXTURE, path)
+    return str(path)
+
+
+def test_sections(tran):
+    psf = PSFFile(tran)
+
+    assert psf.header['analysis name'] == 'tran'
+    assert psf.header['PSF style'] == '7'
+    assert psf.sweep_name == 'time'
+    # the group header and the PROP blocks are not traces
+    assert psf.names == ['in', 'out', 'I0.net1', 'V0:p']
+    assert psf.signal_types == {'in': 'V', 'out': 'V', 'I0.net1': 'V', 'V0:p': 'I'}
+
+
+def test_values(tran):
+    psf = PSFFile(tran, mmap=False)
+
+    np.testing.assert_array_equal(psf.x, [0., 5e-10, 6e-10, 7e-10, 2e-9])
+    np.testing.assert_array_equal(psf['in'], [0., 0., 0.6, 1.2, 1.2])
+    np.testing.assert_array_equal(psf['out'], [1.2, 1.2, 0.6125, 2.4e-3, 1e-6])
+    np.testing.assert_array_equal(psf['V0:p'], [-1.523e-12, -1.523e-12, -4.218e-5, -3.75e-7, -1.611e-12])
+
+
+def test_find(tran):
+    psf = PSFFile(tran)
+
+    assert psf.find('/out') == 'out'
+    assert psf.find('/I0/net1') == 'I0.net1'
+    assert psf.find('/V0/p') == 'V0:p'
+    assert psf.find('/missing') is None
+
+
+def test_mmap_cache(tran):
+    first = PSFFile(tran)
+    assert os.path.exists(tran + '.npy')
+
+    second = PSFFile(tran)
+    assert isinstance(second._matrix, np.memmap)
+    np.testing.assert_array_equal(second.x, first.x)
+    np.testing.assert_array_equal(second['out'], first['out'])
+
+
+def test_load_psf_waves(tmp_path):
+    # one results directory per sweep point, as paramRun writes them
+    for i in [0, 1, 10]:
+        os.makedirs(tmp_path / str(i) / 'psf')
+        shutil.copy(FIXTURE, tmp_path / str(i) / 'psf' / 'tran.tran')
+
+    x, waves, signal_types = load_psf_waves(str(tmp_path), ['/out', '/V0/p', '/missing'])
+
+    assert len(x) == 3
+    assert set(waves.keys()) == {'/out', '/V0/p'}
+    assert len(waves['/out']) == 3
+    np.testing.assert_array_equal(waves['/out'][2], [1.2, 1.2, 0.6125, 2.4e-3, 1e-6])
+    assert signal_types == {'/out': 'V', '/V0/p': 'I'}
+
+
+def test_cache_hit_does_not_read_the_file(tran):
+    first = PSFFile(tran)
+
+    # a cache hit only needs the .npy and .json next to the file, the text is not parsed again
+    mtime = os.path.getmtime(tran)
+    with open(tran, 'w') as f:
+        f.write('HEADER\nnot psf\n')
+    os.utime(tran, (mtime, mtime))
+
+    second = PSFFile(tran)
+    assert second.names == first.names
+    assert second.header == first.header
+    assert second.signal_types == first.signal_types
+    np.testing.assert_array_equal(second['out'], first['out'])
+
+
+def test_chunked_values(tran, monkeypatch):
+    expected = PSFFile(tran, mmap=False)
+
+    # chunks which end in the middle of a point
+    monkeypatch.setattr(PSFFile, 'chunk_size', 60)
+    psf = PSFFile(tran, mmap=False)
+    np.testing.assert_array_equal(psf.x, expected.x)
+    for name in expected.names:
+        np.testing.assert_array_equal(psf[name], expected[name])
+
+
+def test_values_with_other_entries(tran, monkeypatch):
+    # a group header line inside VALUE and a point which was not completely written yet
+    with open(tran, 'r') as f:
+        text = f.read()
+    text = text.replace('VALUE\n', 'VALUE\n"group" 4\n').replace('END\n', '"time" 3e-09\n"in" 1.2\n')
+    with open(tran, 'w') as f:
+        f.write(text)
+
+    monkeypatch.setattr(PSFFile, 'chunk_size', 100)
+    psf = PSFFile(tran, mmap=False)
+    np.testing.assert_array_equal(psf.x, [0., 5e-10, 6e-10, 7e-10, 2e-9])
+    np.testing.assert_array_equal(psf['out'], [1.2, 1.2, 0.6125, 2.4e-3, 1e-6])
+
+
+def test_find_psf_files_newer_than(tmp_path):
+    for i in [0, 1]:
+        os.makedirs(tmp_path / str(i) / 'psf')
+        shutil.copy(FIXTURE, tmp_path / str(i) / 'psf' / 'tran.tran')
+    # left over from an earlier run
+    stale = tmp_path / '1' / 'psf' / 'tran.tran'
+    os.utime(stale, (1e9, 1e9))
+
+    assert len(find_psf_files(str(tmp_path))) == 2
+    assert find_psf_files(str(tmp_path), newer_than=time.time() - 60) == [str(tmp_path / '0' / 'psf' / 'tran.tran')]
@@ -0,0 +1,85 @@
+import asyncio
+import threading
+import time
+
+from virtuosopy.Simulator import Simulator
+
+
+class Schematic:
+    def __init__(self, ws, cell_name):
+        self.ws = ws
+        self.lib_name = 'lib'
+        self.cell_name = cell_name
+
+
+# an OCEAN session which remembers the design and results directory it was last given
+def ocean_impl(session):
+    ok = lambda *args, **kwargs: True
+    impl = {name: ok for name in ['simulator', 'envOption', 'option', 'analysis', 'save', 'saveOption',
+                                  'createNetlist']}
+    impl['design'] = lambda lib, cell, view, mode: session.__setitem__('design', cell)
+    impl['resultsDir'] = lambda path: session.__setitem__('results_dir', path)
+    impl['vpHierarchyStamps'] = lambda *args: []
+    return impl
+
+
+def simulators(ws, session, tmp_path, cells, sim_time=0.02):
+    sims = []
+    for cell in cells:
+        sim = Simulator(Schematic(ws, cell), results_dir=str(tmp_path / cell), renetlist='always', verbose=False)
+        sim.tran(1e-9)
+        sim.events = []
+
+        def simulate(plot_in_v=False, p_values=None, sim=sim):
+            sim.events.append(('simulate', session['design'], session['results_dir']))
+            time.sleep(sim_time)
+
+        def finish_run(key=None, sim=sim):
+            sim.events.append(('extract', session['design'], session['results_dir']))
+            return 0
+
+        sim.simulate = simulate
+        sim.finish_run = finish_run
+        sims.append(sim)
+    return sims
+
+
+def test_runs_on_one_workspace_keep_their_session(fake_ws, tmp_path):
+    session = {}
+    ws = fake_ws(ocean_impl(session))
+    sims = simulators(ws, session, tmp_path, ['A', 'B'])
+
+    async def main():
+        return await asyncio.gather(*[s.run_async() for s in sims * 3])
+
+    assert asyncio.run(main()) == [0] * 6
+    for sim in sims:
+        # every run simulated and extracted with its own design and results directory set
+        expected = (sim.sch.cell_name, sim.results_dir)
+        assert len(sim.events) == 6
+        assert all(e[1:] == expected for e in sim.events)
+
+
+def test_cancelled_run_releases_the_lock(fake_ws, tmp_path):
+    session = {}
+    ws = fake_ws(ocean_impl(session))
+    sim, = simulators(ws, session, tmp_path, ['A'], sim_time=0.2)
+
+    async def main():
+        task = asyncio.ensure_future(sim.run_async())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        # the simulation is still running in its thread and holds the workspace
+        assert sim.workspace_lock().locked()
+
+    asyncio.run(main())
+    deadline = time.time() + 2
+    while sim.workspace_lock().locked() and time.time() < deadline:
+        time.sleep(0.01)
+    assert not sim.workspace_lock().locked()
+    # the workspace can be used again
+    assert sim.run() == 0
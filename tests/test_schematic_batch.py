@@ -0,0 +1,114 @@
+import pytest
+
+from virtuosopy.Instance import symbol_cache
+from virtuosopy.Schematic import Schematic
+
+
+PORTS = {'ports': [{'name': 'D', 'pins': [{'fig': {'bBox': [[0.0, 0.1625], [0.0125, 0.175]]}}]}]}
+
+
+class Pool:
+    def __init__(self, ws):
+        self.ws = ws
+
+    def lease(self, ws_name=None):
+        return self.ws
+
+
+# a schematic cellview holding the objects vpBatch creates, ops are kept in batches
+def schematic_impl(batches, existing_insts=(), existing_shapes=(), deleted=None):
+    def vp_batch(cv, ops):
+        batches.append(ops)
+        results = []
+        for op in ops:
+            if op[0] == 'inst':
+                results.append(f'inst:{op[3]}')
+            elif op[0] == 'wire':
+                results.append([f'wire:{len(results)}'])
+            elif op[0] == 'pin':
+                results.append(f'pin:{op[2]}')
+            else:
+                results.append(None)
+        return results
+
+    return {
+        'db.open_cell_view_by_type': lambda *args: 'cv',
+        'db.open_cell_view': lambda *args: 'symbol cv',
+        'db.delete_object': lambda obj: None,
+        'sch.symbol_to_pin_list': lambda *args: PORTS,
+        'vpViewStamps': lambda *args: [],
+        'vpCellCDFParams': lambda lib, cell: [['w', '1u'], ['l', '180n']],
+        'vpBatch': vp_batch,
+        'vpReadSchematic': lambda cv: [list(existing_insts), [], list(existing_shapes)],
+        'vpTag': lambda objs, sig: objs,
+        'vpDelete': lambda objs: deleted.extend(objs) if deleted is not None else None,
+    }
+
+
+@pytest.fixture
+def make_schematic(fake_ws):
+    symbol_cache.invalidate()
+    opened = []
+
+    def make(impl, **kwargs):
+        ws = fake_ws(impl)
+        ws.on_failover = []
+        ws.close = lambda: None
+        sch = Schematic('lib', 'cell', pool=Pool(ws), verbose=False, **kwargs)
+        opened.append(sch)
+        return sch
+
+    yield make
+    for sch in opened:
+        sch.close()
+
+
+def test_batch_resolves_wire_and_pin_handles(make_schematic):
+    batches = []
+    sch = make_schematic(schematic_impl(batches))
+
+    with sch.batch():
+        n = sch.create_instance('analogLib', 'nmos4', [0., 0.], 'N0')
+        w = sch.create_wire([n.pins.D, n.pins.D.pos + [2., 0.]], 'out')
+        p = sch.create_pin('out', 'output', n.pins.D.pos + [2., 0.])
+        with pytest.raises(Exception, match='until its batch is flushed'):
+            w[0]
+
+    assert len(batches) == 1
+    assert n.inst == 'inst:N0'
+    assert w.value == ['wire:1'] and w[0] == 'wire:1'
+    assert p.value == 'pin:out'
+    assert sch.wires == [['wire:1']]
+
+
+def test_batch_keeps_unchanged_instance_in_incremental_mode(make_schematic):
+    batches = []
+    sch = make_schematic(schematic_impl(batches))
+    with sch.batch():
+        n = sch.create_instance('analogLib', 'nmos4', [0., 0.], 'N0')
+    kept = ['N0', 'analogLib', 'nmos4', list(n.vpos), 'R0', 'w', 'inst:N0']
+
+    batches = []
+    sch = make_schematic(schematic_impl(batches, [kept]), incremental=True)
+    with sch.batch():
+        n = sch.create_instance('analogLib', 'nmos4', [0., 0.], 'N0')
+    # nothing had to be created
+    assert batches == []
+    assert n.inst == 'inst:N0'
+
+    # the kept instance is not part of the flushed batch, its parameters are written directly
+    n['w'] = '2u'
+    sch.flush_params()
+    assert batches == [[['param', 'N0', 'w', '2u']]]
+
+
+@pytest.mark.parametrize('delete_untagged', [False, True])
+def test_incremental_keeps_untagged_shapes(make_schematic, delete_untagged):
+    deleted = []
+    shapes = [[None, 'hand drawn wire'], ['wire;route;((0.0 0.0) (0.0625 0.0));None;None', 'old wire']]
+    sch = make_schematic(schematic_impl([], existing_shapes=shapes, deleted=deleted), incremental=True,
+                         delete_untagged=delete_untagged)
+
+    assert sch.delete_stale() == len(deleted)
+    # the tagged wire was not created again by this run
+    assert deleted == (['old wire', 'hand drawn wire'] if delete_untagged else ['old wire'])
@@ -0,0 +1,62 @@
+import gc
+import os
+
+from virtuosopy.Simulator import Simulator
+
+
+class Schematic:
+    def __init__(self, ws):
+        self.ws = ws
+        self.lib_name = 'lib'
+        self.cell_name = 'inv'
+        # Simulator only checks that the schematic came from a WorkspacePool
+        self.pool = object()
+
+
+def ocean_impl():
+    ok = lambda *args, **kwargs: True
+    return {name: ok for name in ['simulator', 'design', 'resultsDir', 'envOption', 'option', 'analysis', 'save',
+                                  'createNetlist']} | {'vpHierarchyStamps': lambda *args: []}
+
+
+def test_failover_callback_does_not_keep_simulator_alive(fake_ws, tmp_path):
+    ws = fake_ws(ocean_impl())
+    ws.on_failover = []
+
+    sim = Simulator(Schematic(ws), results_dir=str(tmp_path), renetlist='always', verbose=False)
+    assert len(ws.on_failover) == 1
+
+    # a failover sets the OCEAN session up again
+    designs = ws.calls['design']
+    ws.on_failover[0](ws)
+    assert ws.calls['design'] == designs + 1
+
+    del sim
+    gc.collect()
+    assert ws.on_failover == []
+
+
+def test_netlist_modes(fake_ws, tmp_path):
+    netlists = []
+
+    def create_netlist(recreate_all=False, display=False):
+        netlists.append(recreate_all)
+        os.makedirs(tmp_path / 'netlist', exist_ok=True)
+        (tmp_path / 'netlist' / 'netlist').write_text('')
+        return True
+
+    impl = ocean_impl()
+    impl['createNetlist'] = create_netlist
+    ws = fake_ws(impl)
+    ws.on_failover = []
+
+    # the whole hierarchy is netlisted every time unless the netlist may be reused
+    sim = Simulator(Schematic(ws), results_dir=str(tmp_path), verbose=False)
+    sim.netlist()
+    assert netlists == [True, True]
+    assert ws.calls['vpHierarchyStamps'] == 0
+
+    sim.renetlist = 'auto'
+    sim.netlist()
+    sim.netlist()
+    assert netlists == [True, True, False]
@@ -0,0 +1,170 @@
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from virtuosopy.Simulator import Simulator
+from virtuosopy.SpectreBackend import SpectreBackend
+
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'data', 'psf', 'tran.tran')
+
+
+# stands in for spectre: writes the PSF-ASCII fixture as <raw dir>/tran.tran, as 'spectre -raw <raw dir>' would
+# the deck parameters fail=n and sleep=s make it fail its first n runs of a point and wait s seconds before finishing,
+# every run is counted in <point dir>/attempts
+STUB = f'''
+import shutil
+import sys
+import time
+import os
+
+args = sys.argv[1:]
+raw = args[args.index('-raw') + 1]
+deck = [a for a in args if a.endswith('input.scs')][0]
+params = dict(p.split('=') for line in open(deck) if line.startswith('parameters ') for p in line.split()[1:])
+
+attempts = int(open('attempts').read()) + 1 if os.path.exists('attempts') else 1
+open('attempts.tmp', 'w').write(str(attempts))
+os.replace('attempts.tmp', 'attempts')
+
+time.sleep(float(params.get('sleep', 0)))
+if attempts <= int(params.get('fail', 0)):
+    sys.exit(1)
+
+os.makedirs(raw, exist_ok=True)
+shutil.copy({FIXTURE!r}, os.path.join(raw, 'tran.tran'))
+'''
+
+
+class Schematic:
+    def __init__(self, ws):
+        self.ws = ws
+        self.lib_name = 'lib'
+        self.cell_name = 'inv'
+        self.pool = object()
+
+
+@pytest.fixture
+def backend(tmp_path):
+    stub = tmp_path / 'spectre_stub.py'
+    stub.write_text(STUB)
+    netlist_dir = tmp_path / 'netlist'
+    netlist_dir.mkdir()
+    (netlist_dir / 'netlist').write_text('I0 (in out) inv\n')
+    return SpectreBackend(str(netlist_dir), str(tmp_path / 'run'), spectre_cmd=f'{sys.executable} {stub}',
+                          max_workers=2, verbose=False)
+
+
+def read_deck(backend, i):
+    with open(os.path.join(backend.point_dir(i), 'input.scs')) as f:
+        return f.read().splitlines()
+
+
+def test_write_deck(backend, tmp_path):
+    deck = str(tmp_path / 'input.scs')
+    backend.write_deck(deck, {'/out': 'v', '/I0/M0/D': 'i'}, 2e-9, temp=85, model_files=['/models/tt.scs'],
+                       stim_file='/stim/stimuli.scs', params={'vdd': 1.2, 'w': '1u'})
+
+    with open(deck) as f:
+        lines = f.read().splitlines()
+    assert lines[1:] == ['simulator lang=spectre',
+                         'global 0',
+                         'include "/models/tt.scs"',
+                         f'include "{backend.netlist_dir}/netlist"',
+                         'include "/stim/stimuli.scs"',
+                         'parameters vdd=1.2 w=1u',
+                         'vpOptions options temp=85',
+                         'tran tran stop=2e-09 errpreset=moderate',
+                         'save out I0.M0:D']
+
+
+def test_run_and_load(backend):
+    ok = backend.run({'/out': 'v', '/in': 'v'}, 2e-9, params={'vdd': 1.2, 'w': '1u'}, p_values={'w': ['1u', '2u']})
+    assert ok
+    assert backend.returncodes == [0, 0]
+
+    # variables which are not swept are in every deck, swept ones take the value of their point
+    assert 'parameters vdd=1.2 w=1u' in read_deck(backend, 0)
+    assert 'parameters vdd=1.2 w=2u' in read_deck(backend, 1)
+
+    x, waves, signal_types = backend.load(['/out', '/in', '/missing'])
+    assert len(x) == 2
+    np.testing.assert_array_equal(x[1], [0., 5e-10, 6e-10, 7e-10, 2e-9])
+    np.testing.assert_array_equal(waves['/out'][0], [1.2, 1.2, 0.6125, 2.4e-3, 1e-6])
+    assert '/missing' not in waves
+    assert signal_types['/in'] == 'V'
+
+
+def test_simulator_passes_design_vars(fake_ws, backend, tmp_path):
+    ok = lambda *args, **kwargs: True
+    ws = fake_ws({name: ok for name in ['simulator', 'design', 'resultsDir', 'envOption', 'option', 'analysis',
+                                        'saveOption', 'desVar', 'createNetlist']})
+    ws.on_failover = []
+    sim = Simulator(Schematic(ws), results_dir=str(tmp_path), verbose=False)
+    sim.spectre = backend
+    sim.tran('2n')
+
+    sim.set_var('vdd', 1.2)
+    sim.set_var('w', '1u')
+    sim.simulate(p_values={'l': ['100n', '200n']})
+
+    assert 'parameters vdd=1.2 w=1u l=100n' in read_deck(backend, 0)
+    assert 'parameters vdd=1.2 w=1u l=200n' in read_deck(backend, 1)
+
+
+def attempts(backend, i):
+    with open(os.path.join(backend.point_dir(i), 'attempts')) as f:
+        return int(f.read())
+
+
+@pytest.mark.parametrize('retries, ok', [(2, True), (1, False)])
+def test_retries(backend, retries, ok):
+    backend.retries = retries
+
+    # the point fails twice before it succeeds
+    assert backend.run({'/out': 'v'}, 2e-9, params={'fail': 2}) == ok
+    assert attempts(backend, 0) == min(3, retries + 1)
+    assert backend.returncodes == ([0] if ok else [1])
+
+
+def test_fail_fast(backend):
+    backend.max_workers = 1
+    backend.retries = 0
+
+    # point 0 fails, the points queued behind it are cancelled before they start
+    assert not backend.run({'/out': 'v'}, 2e-9, params={'sleep': 0.5}, p_values={'fail': [1, 0, 0, 0]},
+                           fail_fast=True)
+    assert backend.returncodes[0] == 1
+    assert backend.returncodes[-1] is None
+    # a point which had already been handed to the worker is stopped without counting as failed
+    assert all(rc is None for rc in backend.returncodes[1:])
+    assert not os.path.exists(os.path.join(backend.point_dir(3), 'attempts'))
+
+
+def test_cancel(backend):
+    done = []
+    run = threading.Thread(target=lambda: done.append(backend.run({'/out': 'v'}, 2e-9, params={'sleep': 30},
+                                                                   p_values={'w': ['1u', '2u']})))
+    start = time.time()
+    run.start()
+
+    pid_files = [os.path.join(backend.point_dir(i), 'spectre.pid') for i in range(2)]
+    while not all(os.path.exists(os.path.join(backend.point_dir(i), 'attempts')) for i in range(2)):
+        assert time.time() - start < 10
+        time.sleep(0.01)
+
+    backend.cancel()
+    run.join(10)
+    assert not run.is_alive()
+    assert time.time() - start < 10
+
+    assert done == [False]
+    assert backend.returncodes == [None, None]
+    for i in range(2):
+        assert os.path.exists(os.path.join(backend.point_dir(i), 'cancelled'))
+        assert not os.path.exists(pid_files[i])
+        assert attempts(backend, i) == 1